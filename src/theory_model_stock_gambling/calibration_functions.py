@@ -0,0 +1,344 @@
+"""Functions for calibrating the preference parameters of the power and log utility
+models.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from scipy.optimize import least_squares
+from sympy import Matrix, exp, log, symbols
+
+from theory_model_stock_gambling.config import MODEL_RUN_CONFIGURATION
+from theory_model_stock_gambling.model_functions import (
+    calculate_certainty_equivalent_power,
+    calculate_expected_utility_log,
+    calculate_minimum_wealth,
+    generate_system_of_equations_log_utility,
+    generate_system_of_equations_power_utility,
+    lambdify_vectorized,
+    solve_system_with_newton,
+)
+
+CALIBRATION_PARAMETERS = {
+    "power": ["Variance_Weight", "Risk_Aversion_Agent_1", "Risk_Aversion_Agent_2"],
+    "log": ["Skewness_Weight"]}
+
+CALIBRATION_BOUNDS = {
+    "Variance_Weight": (-np.inf, np.inf),
+    "Risk_Aversion_Agent_1": (0, np.inf),
+    "Risk_Aversion_Agent_2": (0, np.inf),
+    "Skewness_Weight": (-np.inf, np.inf)}
+
+CALIBRATION_TARGETS = ["p", "x_2", "Welfare_Gap"]
+
+
+def generate_equilibrium_moments_function(parameters_to_calibrate, model_run_configuration = MODEL_RUN_CONFIGURATION, utility_function = "power"):
+    """This function generates a function which solves the power or log utility model
+    for given values of the calibrated parameters and returns the equilibrium moments
+    together with their exact derivatives with respect to the parameters.
+
+    The derivatives follow from the implicit function theorem applied to the system of
+    first order conditions and market clearing, d(x_1, x_2, p)/d(theta) =
+    -J_x^{-1} J_theta, where both Jacobians are derived symbolically.
+
+    Args:
+        parameters_to_calibrate (list): The keys of MODEL_RUN_CONFIGURATION to calibrate,
+            a subset of CALIBRATION_PARAMETERS[utility_function].
+        model_run_configuration (dict): The values of all other parameters.
+        utility_function (str): The model to calibrate, "power" or "log".
+
+    Returns:
+        function: Maps the parameter values and a starting point (x_1, x_2, p) to the
+            equilibrium (x_1, x_2, p), the moments (p, x_2, Welfare_Gap) and the
+            derivatives of the moments of shape (3, len(parameters_to_calibrate)). It
+            raises a ValueError if no equilibrium with positive wealth in every state is
+            found from the starting point.
+
+    """
+    if utility_function not in CALIBRATION_PARAMETERS:
+        info = f"The utility function has to be one of {list(CALIBRATION_PARAMETERS)}, got {utility_function}."
+        raise ValueError(info)
+
+    unknown_parameters = set(parameters_to_calibrate) - set(CALIBRATION_PARAMETERS[utility_function])
+    if unknown_parameters:
+        info = f"Only {CALIBRATION_PARAMETERS[utility_function]} can be calibrated in the {utility_function} utility model, got {sorted(unknown_parameters)}."
+        raise ValueError(info)
+
+    variables = symbols("x_1 x_2 p")
+    parameters = symbols(parameters_to_calibrate)
+
+    configuration = dict(model_run_configuration)
+    configuration.update(zip(parameters_to_calibrate, parameters, strict=True))
+
+    if utility_function == "power":
+        system_of_equations_to_solve = generate_system_of_equations_power_utility(
+        W_1 = configuration["Initial_Wealth_Agent_1"],
+        W_2 = configuration["Intial_Wealth_Agent_2"],
+        prob_e_1_high = configuration["Endowment_Probability_High_Agent_1"], return_e_1_high = configuration["Endowment_Payoff_High_Agent_1"],
+        return_e_1_low = configuration["Endowment_Payoff_Low_Agent_1"], prob_e_2_high = configuration["Endowment_Probability_High_Agent_2"],
+        return_e_2_high = configuration["Endowment_Payoff_High_Agent_2"],
+        return_e_2_low = configuration["Endowment_Payoff_Low_Agent_2"], prob_R_high = configuration["Stock_Probability_High"], return_R_high = configuration["Stock_Payoff_High"],
+        return_R_low = configuration["Stock_Payoff_Low"],
+        risk_aversion_1 = configuration["Risk_Aversion_Agent_1"],
+        risk_aversion_2 = configuration["Risk_Aversion_Agent_2"],
+        variance_weight = configuration["Variance_Weight"])
+
+        certainty_equivalent_agent_1 = calculate_certainty_equivalent_power(
+        W_0 = configuration["Initial_Wealth_Agent_1"], x = variables[0], prob_e_high = configuration["Endowment_Probability_High_Agent_1"],
+        Return_e_high = configuration["Endowment_Payoff_High_Agent_1"], Return_e_low = configuration["Endowment_Payoff_Low_Agent_1"], prob_R_high = configuration["Stock_Probability_High"], Return_R_high = configuration["Stock_Payoff_High"],
+        Return_R_low = configuration["Stock_Payoff_Low"],
+        price = variables[2],
+        gamma = configuration["Risk_Aversion_Agent_1"])
+
+        certainty_equivalent_agent_2 = calculate_certainty_equivalent_power(
+        W_0 = configuration["Intial_Wealth_Agent_2"], x = variables[1], prob_e_high = configuration["Endowment_Probability_High_Agent_2"],
+        Return_e_high = configuration["Endowment_Payoff_High_Agent_2"], Return_e_low = configuration["Endowment_Payoff_Low_Agent_2"], prob_R_high = configuration["Stock_Probability_High"], Return_R_high = configuration["Stock_Payoff_High"],
+        Return_R_low = configuration["Stock_Payoff_Low"],
+        price = variables[2],
+        gamma = configuration["Risk_Aversion_Agent_2"])
+
+    else:
+        system_of_equations_to_solve = generate_system_of_equations_log_utility(
+        W_1 = configuration["Initial_Wealth_Agent_1"],
+        W_2 = configuration["Intial_Wealth_Agent_2"],
+        prob_e_1_high = configuration["Endowment_Probability_High_Agent_1"], return_e_1_high = configuration["Endowment_Payoff_High_Agent_1"],
+        return_e_1_low = configuration["Endowment_Payoff_Low_Agent_1"], prob_e_2_high = configuration["Endowment_Probability_High_Agent_2"],
+        return_e_2_high = configuration["Endowment_Payoff_High_Agent_2"],
+        return_e_2_low = configuration["Endowment_Payoff_Low_Agent_2"], prob_R_high = configuration["Stock_Probability_High"], return_R_high = configuration["Stock_Payoff_High"],
+        return_R_low = configuration["Stock_Payoff_Low"],
+        skewness_weight = configuration["Skewness_Weight"])
+
+        certainty_equivalent_agent_1 = exp(calculate_expected_utility_log(
+        W_0 = configuration["Initial_Wealth_Agent_1"], x = variables[0], prob_e_high = configuration["Endowment_Probability_High_Agent_1"],
+        Return_e_high = configuration["Endowment_Payoff_High_Agent_1"], Return_e_low = configuration["Endowment_Payoff_Low_Agent_1"], prob_R_high = configuration["Stock_Probability_High"], Return_R_high = configuration["Stock_Payoff_High"],
+        Return_R_low = configuration["Stock_Payoff_Low"],
+        price = variables[2],
+        log_function = log))
+
+        certainty_equivalent_agent_2 = exp(calculate_expected_utility_log(
+        W_0 = configuration["Intial_Wealth_Agent_2"], x = variables[1], prob_e_high = configuration["Endowment_Probability_High_Agent_2"],
+        Return_e_high = configuration["Endowment_Payoff_High_Agent_2"], Return_e_low = configuration["Endowment_Payoff_Low_Agent_2"], prob_R_high = configuration["Stock_Probability_High"], Return_R_high = configuration["Stock_Payoff_High"],
+        Return_R_low = configuration["Stock_Payoff_Low"],
+        price = variables[2],
+        log_function = log))
+
+    welfare_gap = Matrix([certainty_equivalent_agent_2 - certainty_equivalent_agent_1])
+
+    system = Matrix(system_of_equations_to_solve)
+
+    residual_function = lambdify_vectorized(list(system), variables, parameters)
+    jacobian_variables_function = lambdify_vectorized(list(system.jacobian(variables)), variables, parameters)
+    jacobian_parameters_function = lambdify_vectorized(list(system.jacobian(parameters)), variables, parameters)
+    welfare_gap_function = lambdify_vectorized(list(welfare_gap), variables, parameters)
+    welfare_gap_gradient_function = lambdify_vectorized([*welfare_gap.jacobian(variables), *welfare_gap.jacobian(parameters)], variables, parameters)
+
+    number_of_parameters = len(parameters)
+
+    def is_feasible(points):
+        minimum_wealth_agent_1 = calculate_minimum_wealth(model_run_configuration["Initial_Wealth_Agent_1"], points[:, 0], model_run_configuration["Endowment_Payoff_High_Agent_1"], model_run_configuration["Endowment_Payoff_Low_Agent_1"], model_run_configuration["Stock_Payoff_High"], model_run_configuration["Stock_Payoff_Low"], points[:, 2])
+        minimum_wealth_agent_2 = calculate_minimum_wealth(model_run_configuration["Intial_Wealth_Agent_2"], points[:, 1], model_run_configuration["Endowment_Payoff_High_Agent_2"], model_run_configuration["Endowment_Payoff_Low_Agent_2"], model_run_configuration["Stock_Payoff_High"], model_run_configuration["Stock_Payoff_Low"], points[:, 2])
+        return (minimum_wealth_agent_1 > 0) & (minimum_wealth_agent_2 > 0)
+
+    def calculate_equilibrium_moments(parameter_values, starting_point):
+        #Newton's method keeps wealth positive in every state, so a converged point is a valid equilibrium
+        points, converged, _ = solve_system_with_newton(
+            lambda points: (residual_function(points, *parameter_values), jacobian_variables_function(points, *parameter_values).reshape(len(points), 3, 3)),
+            np.atleast_2d(starting_point),
+            is_feasible=is_feasible)
+
+        if not converged[0]:
+            info = f"No equilibrium with positive wealth could be found for the parameters {dict(zip(parameters_to_calibrate, parameter_values, strict=True))}."
+            raise ValueError(info)
+
+        point = points[:1]
+
+        jacobian_variables = jacobian_variables_function(point, *parameter_values).reshape(3, 3)
+        jacobian_parameters = jacobian_parameters_function(point, *parameter_values).reshape(3, number_of_parameters)
+
+        derivative_equilibrium = -np.linalg.solve(jacobian_variables, jacobian_parameters)
+
+        welfare_gap_gradient = welfare_gap_gradient_function(point, *parameter_values)[0]
+
+        moments = np.array([point[0, 2], point[0, 1], welfare_gap_function(point, *parameter_values)[0, 0]])
+
+        derivative_moments = np.vstack([
+            derivative_equilibrium[2],
+            derivative_equilibrium[1],
+            welfare_gap_gradient[:3] @ derivative_equilibrium + welfare_gap_gradient[3:],
+        ])
+
+        return point[0], moments, derivative_moments
+
+    return calculate_equilibrium_moments
+
+
+def calibrate_preference_parameters(targets, parameters_to_calibrate, model_run_configuration = MODEL_RUN_CONFIGURATION, initial_guess = None, starting_point = (0.5, 0.5, 1), bounds = None, calculate_equilibrium_moments = None, utility_function = "power"):
+    """This function calibrates preference parameters of the power or log utility model
+    to target equilibrium moments by nonlinear least squares with exact gradients.
+
+    Every equilibrium along the optimization is warm started from the previous one. If
+    the equilibrium cannot be found at a trial point, its moments are NaN and the
+    optimizer shrinks its step. Only a calibration whose initial or final equilibrium
+    cannot be found is reported as failed.
+
+    Args:
+        targets (dict): The target moments, with keys in CALIBRATION_TARGETS. The
+            welfare gap is the certainty equivalent wealth of agent 2 minus that of
+            agent 1, which is continuous across gamma = 1 and comparable across risk
+            aversions.
+        parameters_to_calibrate (list): The keys of MODEL_RUN_CONFIGURATION to calibrate.
+        model_run_configuration (dict): The values of all other parameters.
+        initial_guess (dict): The starting values of the calibrated parameters, defaults
+            to their values in model_run_configuration.
+        starting_point (tuple): The starting point (x_1, x_2, p) of the first equilibrium.
+        bounds (tuple): The lower and upper bounds of the parameters as in
+            scipy.optimize.least_squares, defaults to CALIBRATION_BOUNDS.
+        calculate_equilibrium_moments (function): The output of
+            generate_equilibrium_moments_function, generated if not given.
+        utility_function (str): The model to calibrate, "power" or "log".
+
+    Returns:
+        dict: The calibrated parameters, the equilibrium values 'x_1', 'x_2', 'p' and
+            'Welfare_Gap', the 'Cost' (half the sum of squared deviations) and 'Success'.
+            If the calibration failed, the values are NaN and 'Success' is False.
+
+    """
+    unknown_targets = set(targets) - set(CALIBRATION_TARGETS)
+    if unknown_targets:
+        info = f"Only {CALIBRATION_TARGETS} can be targeted, got {sorted(unknown_targets)}."
+        raise ValueError(info)
+
+    if calculate_equilibrium_moments is None:
+        calculate_equilibrium_moments = generate_equilibrium_moments_function(parameters_to_calibrate, model_run_configuration, utility_function)
+
+    if bounds is None:
+        bounds = tuple(np.array([CALIBRATION_BOUNDS[name] for name in parameters_to_calibrate]).T)
+
+    if initial_guess is None:
+        initial_guess = {name: model_run_configuration[name] or 0 for name in parameters_to_calibrate}
+
+    target_index = [CALIBRATION_TARGETS.index(name) for name in targets]
+    target_values = np.array(list(targets.values()), dtype=float)
+
+    #Cache the last evaluation, least squares asks for residuals and Jacobian separately
+    last_evaluation = {"parameter_values": None, "point": np.array(starting_point, dtype=float), "failed": False}
+
+    def evaluate(parameter_values):
+        if not np.array_equal(parameter_values, last_evaluation["parameter_values"]):
+            try:
+                point, moments, derivative_moments = calculate_equilibrium_moments(parameter_values, last_evaluation["point"])
+                failed = False
+            except ValueError:
+                #Keep warm starting from the last equilibrium, least squares rejects non-finite trial points
+                point, moments, derivative_moments = last_evaluation["point"], np.full(3, np.nan), np.full((3, len(parameters_to_calibrate)), np.nan)
+                failed = True
+            last_evaluation.update(parameter_values=parameter_values.copy(), point=point, moments=moments, derivative_moments=derivative_moments, failed=failed)
+        return last_evaluation
+
+    def residuals(parameter_values):
+        return evaluate(parameter_values)["moments"][target_index] - target_values
+
+    def jacobian(parameter_values):
+        return evaluate(parameter_values)["derivative_moments"][target_index]
+
+    try:
+        solution = least_squares(residuals, [initial_guess[name] for name in parameters_to_calibrate], jac=jacobian, bounds=bounds)
+    except ValueError:
+        #Only a missing initial equilibrium is a failed calibration, invalid arguments are raised
+        if last_evaluation["failed"]:
+            return generate_failed_calibration_result(parameters_to_calibrate)
+        raise
+
+    evaluation = evaluate(solution.x)
+
+    if evaluation["failed"]:
+        return generate_failed_calibration_result(parameters_to_calibrate)
+
+    return {
+        **dict(zip(parameters_to_calibrate, solution.x.tolist(), strict=True)),
+        "x_1": float(evaluation["point"][0]),
+        "x_2": float(evaluation["point"][1]),
+        "p": float(evaluation["point"][2]),
+        "Welfare_Gap": float(evaluation["moments"][2]),
+        "Cost": float(solution.cost),
+        "Success": bool(solution.success),
+    }
+
+
+def generate_failed_calibration_result(parameters_to_calibrate):
+    """This function generates the output of a failed calibration, with NaN values and
+    'Success' set to False.
+    """
+    return {**dict.fromkeys([*parameters_to_calibrate, "x_1", "x_2", "p", "Welfare_Gap", "Cost"], np.nan), "Success": False}
+
+
+def calibrate_preference_parameters_sequentially(target_sets, parameters_to_calibrate, model_run_configuration = MODEL_RUN_CONFIGURATION, initial_guess = None, bounds = None, utility_function = "power"):
+    """This function calibrates the preference parameters to several target sets in a
+    row, warm starting each calibration from the solution of the previous one.
+
+    Args:
+        target_sets (list): The target moments, each a dict as in calibrate_preference_parameters.
+        parameters_to_calibrate (list): The keys of MODEL_RUN_CONFIGURATION to calibrate.
+        model_run_configuration (dict): The values of all other parameters.
+        initial_guess (dict): The starting values of the first calibration.
+        bounds (tuple): The lower and upper bounds of the parameters, defaults to CALIBRATION_BOUNDS.
+        utility_function (str): The model to calibrate, "power" or "log".
+
+    Returns:
+        list: The output of calibrate_preference_parameters for each target set.
+
+    """
+    calculate_equilibrium_moments = generate_equilibrium_moments_function(parameters_to_calibrate, model_run_configuration, utility_function)
+
+    starting_point = (0.5, 0.5, 1)
+
+    results = []
+    for targets in target_sets:
+        result = calibrate_preference_parameters(targets, parameters_to_calibrate, model_run_configuration, initial_guess, starting_point, bounds, calculate_equilibrium_moments, utility_function)
+
+        if result["Success"]:
+            initial_guess = {name: result[name] for name in parameters_to_calibrate}
+            starting_point = (result["x_1"], result["x_2"], result["p"])
+
+        results.append(result)
+
+    return results
+
+
+def calibrate_preference_parameters_in_parallel(target_sets, parameters_to_calibrate, model_run_configuration = MODEL_RUN_CONFIGURATION, initial_guess = None, bounds = None, n_workers = None, utility_function = "power"):
+    """This function calibrates the preference parameters to many target sets in
+    parallel processes.
+
+    The target sets are split into one contiguous chunk per worker and each chunk is
+    calibrated sequentially with warm starts, so neighbouring target sets should be
+    similar.
+
+    Args:
+        target_sets (list): The target moments, each a dict as in calibrate_preference_parameters.
+        parameters_to_calibrate (list): The keys of MODEL_RUN_CONFIGURATION to calibrate.
+        model_run_configuration (dict): The values of all other parameters.
+        initial_guess (dict): The starting values of the first calibration of each chunk.
+        bounds (tuple): The lower and upper bounds of the parameters, defaults to CALIBRATION_BOUNDS.
+        n_workers (int): The number of processes, defaults to the number of CPUs.
+        utility_function (str): The model to calibrate, "power" or "log".
+
+    Returns:
+        list: The output of calibrate_preference_parameters for each target set, in the
+            order of target_sets.
+
+    """
+    if len(target_sets) == 0:
+        return []
+
+    calibrate_chunk = partial(calibrate_preference_parameters_sequentially, parameters_to_calibrate=parameters_to_calibrate, model_run_configuration=model_run_configuration, initial_guess=initial_guess, bounds=bounds, utility_function=utility_function)
+
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    chunks = [chunk.tolist() for chunk in np.array_split(np.array(target_sets, dtype=object), n_workers) if len(chunk) > 0]
+
+    with ProcessPoolExecutor(len(chunks)) as executor:
+        results = list(executor.map(calibrate_chunk, chunks))
+
+    return [result for chunk in results for result in chunk]
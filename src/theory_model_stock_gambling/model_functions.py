@@ -1,9 +1,11 @@
+import functools
 import math
 
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from sympy import nsolve, symbols
+from mpmath import findroot
+from sympy import Abs, Matrix, Piecewise, exp, lambdify, log, symbols
 
 from theory_model_stock_gambling.config import p
 
@@ -29,7 +31,36 @@ def calculate_equilibrium_solution_power_utility(W_1, W_2, prob_e_1_high, return
         variance_weight (float): The weight of the variance term in the utility function of agent 2
 
     Returns:
-        dictionary: The equilibrium solution with (x_1, x_2, p)
+        EquilibriumResult: The equilibrium solution with (x_1, x_2, p)
+
+    """
+    system_of_equations_to_solve = generate_system_of_equations_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weight)
+
+    return calculate_equilibrium(system_of_equations_to_solve)
+
+
+def generate_system_of_equations_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weight = None):
+    """This function generates the system of equations for the model with 2 agents,
+    power utility and 1 asset.
+
+    Args:
+        W_1 (float): The initial wealth of agent 1
+        W_2 (float): The initial wealth of agent 2
+        prob_e_1_high (float): The probability of the high endowment of agent 1
+        return_e_1_high (float): The return of the high endowment of agent 1
+        return_e_1_low (float): The return of the low endowment of agent 1
+        prob_e_2_high (float): The probability of the high endowment of agent 2
+        return_e_2_high (float): The return of the high endowment of agent 2
+        return_e_2_low (float): The return of the low endowment of agent 2
+        prob_R_high (float): The probability of the high return of the stock
+        return_R_high (float): The return of the high return of the stock
+        return_R_low (float): The return of the low return of the stock
+        risk_aversion_1 (float): The risk aversion parameter of agent 1
+        risk_aversion_2 (float): The risk aversion parameter of agent 2
+        variance_weight (float): The weight of the variance term in the utility function of agent 2
+
+    Returns:
+        list: The two first order conditions and the market clearing condition in (x_1, x_2, p)
 
     """
     #Initialize values
@@ -55,9 +86,7 @@ def calculate_equilibrium_solution_power_utility(W_1, W_2, prob_e_1_high, return
 
     market_clearing_condition = generate_market_clearing_condition(x_1, x_2)
 
-    system_of_equations_to_solve = generate_system_of_equations_to_solve(optimization_condition_agent_1, optimization_condition_agent_2, market_clearing_condition)
-
-    return calculate_equilibrium(system_of_equations_to_solve)
+    return generate_system_of_equations_to_solve(optimization_condition_agent_1, optimization_condition_agent_2, market_clearing_condition)
 
 
 def generate_optimization_condition_agent_power_and_variance_utility_1_asset(W, x, prob_e_high, Return_e_high, Return_e_low, prob_R_high, Return_R_high, Return_R_low, gamma, variance_weight):
@@ -107,9 +136,37 @@ def calculate_equilibrium_solution_log_utility(W_1, W_2, prob_e_1_high, return_e
         prob_R_high (float): The probability of the high return of the stock
         return_R_high (float): The return of the high return of the stock
         return_R_low (float): The return of the low return of the stock
+        skewness_weight (float): The weight of the skewness term in the utility function of agent 2
 
     Returns:
-        dictionary: The equilibrium solution with (x_1, x_2, p)
+        EquilibriumResult: The equilibrium solution with (x_1, x_2, p)
+
+    """
+    system_of_equations_to_solve = generate_system_of_equations_log_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, skewness_weight)
+
+    return calculate_equilibrium(system_of_equations_to_solve)
+
+
+def generate_system_of_equations_log_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, skewness_weight = None):
+    """This function generates the system of equations for the model with 2 agents,
+    log utility and 1 asset.
+
+    Args:
+        W_1 (float): The initial wealth of agent 1
+        W_2 (float): The initial wealth of agent 2
+        prob_e_1_high (float): The probability of the high endowment of agent 1
+        return_e_1_high (float): The return of the high endowment of agent 1
+        return_e_1_low (float): The return of the low endowment of agent 1
+        prob_e_2_high (float): The probability of the high endowment of agent 2
+        return_e_2_high (float): The return of the high endowment of agent 2
+        return_e_2_low (float): The return of the low endowment of agent 2
+        prob_R_high (float): The probability of the high return of the stock
+        return_R_high (float): The return of the high return of the stock
+        return_R_low (float): The return of the low return of the stock
+        skewness_weight (float): The weight of the skewness term in the utility function of agent 2
+
+    Returns:
+        list: The two first order conditions and the market clearing condition in (x_1, x_2, p)
 
     """
     #Initialize variables to solve for
@@ -133,9 +190,7 @@ def calculate_equilibrium_solution_log_utility(W_1, W_2, prob_e_1_high, return_e
 
     market_clearing_condition = generate_market_clearing_condition(x_1, x_2)
 
-    system_of_equations_to_solve = generate_system_of_equations_to_solve(optimization_condition_agent_1, optimization_condition_agent_2, market_clearing_condition)
-
-    return calculate_equilibrium(system_of_equations_to_solve)
+    return generate_system_of_equations_to_solve(optimization_condition_agent_1, optimization_condition_agent_2, market_clearing_condition)
 
 
 
@@ -206,6 +261,90 @@ def generate_system_of_equations_to_solve(optimization_condition_agent_1, optimi
     return [optimization_condition_agent_1, optimization_condition_agent_2, market_clearing_condition]
 
 
+EQUILIBRIUM_RESULT_COLUMNS = ["x_1", "x_2", "p", "Utility_Agent_1", "Utility_Agent_2", "Residual", "Converged", "Iterations", "Stable"]
+
+STABILITY_VALUES = {"stable": 1.0, "unstable": 0.0, "degenerate": np.nan}
+
+
+class EquilibriumResult:
+    """The equilibrium of one parameter point as plain float64 values.
+
+    The values can be read as attributes or, like the former result dictionaries, by
+    the attribute names or the column names in EQUILIBRIUM_RESULT_COLUMNS, e.g.
+    result["Utility_Agent_1"]. Utilities are NaN until they are calculated.
+
+    Attributes:
+        x_1 (float): The holding of the stock of agent 1
+        x_2 (float): The holding of the stock of agent 2
+        p (float): The price of the stock
+        utility_agent_1 (float): The expected utility of agent 1
+        utility_agent_2 (float): The expected utility of agent 2
+        residual (float): The largest absolute residual of the system at the solution
+        converged (float): 1.0 if the solver converged, else 0.0. Solvers raise if they do
+            not converge, so 0.0 only appears in batch results for failed points
+        iterations (float): The number of Newton iterations of the solver, NaN for
+            equilibria reached from several starting points
+        stable (float): 1.0 if the equilibrium is tatonnement stable, 0.0 if it is
+            unstable and NaN if its stability is degenerate or was not classified
+
+    """
+
+    __slots__ = ("x_1", "x_2", "p", "utility_agent_1", "utility_agent_2", "residual", "converged", "iterations", "stable")
+
+    def __init__(self, x_1, x_2, p, utility_agent_1 = np.nan, utility_agent_2 = np.nan, residual = np.nan, converged = 1.0, iterations = np.nan, stable = np.nan):
+        for name, value in zip(self.__slots__, (x_1, x_2, p, utility_agent_1, utility_agent_2, residual, converged, iterations, stable), strict=True):
+            setattr(self, name, float(value))
+
+    def __getitem__(self, key):
+        name = EQUILIBRIUM_RESULT_ATTRIBUTES.get(key, key)
+        if name not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, name)
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"EquilibriumResult({values})"
+
+    def to_array(self):
+        """Return the values as a float64 array in the order of EQUILIBRIUM_RESULT_COLUMNS."""
+        return np.array([getattr(self, name) for name in self.__slots__], dtype=np.float64)
+
+
+EQUILIBRIUM_RESULT_ATTRIBUTES = dict(zip(EQUILIBRIUM_RESULT_COLUMNS, EquilibriumResult.__slots__, strict=True))
+
+
+def allocate_equilibrium_results(number_of_points):
+    """This function allocates a contiguous array for the results of a batch of
+    parameter points.
+
+    Each column is contiguous in memory, so equilibrium_results_to_dataframe can wrap
+    the array without copying it. Unsolved points stay NaN.
+
+    Args:
+        number_of_points (int): The number of parameter points
+
+    Returns:
+        np.ndarray: A float64 array of shape (number_of_points, len(EQUILIBRIUM_RESULT_COLUMNS)).
+
+    """
+    return np.full((number_of_points, len(EQUILIBRIUM_RESULT_COLUMNS)), np.nan, dtype=np.float64, order="F")
+
+
+def equilibrium_results_to_dataframe(results, index = None):
+    """This function wraps an array of equilibrium results in a dataframe without
+    copying it.
+
+    Args:
+        results (np.ndarray): The output of allocate_equilibrium_results, filled in.
+        index (list): The index of the dataframe
+
+    Returns:
+        pd.DataFrame: A dataframe with the columns EQUILIBRIUM_RESULT_COLUMNS.
+
+    """
+    return pd.DataFrame(results, index=index, columns=EQUILIBRIUM_RESULT_COLUMNS, copy=False)
+
+
 def calculate_equilibrium(system_of_equations_to_solve):
     """This function calculates the equilibrium.
 
@@ -213,7 +352,8 @@ def calculate_equilibrium(system_of_equations_to_solve):
         system_of_equations_to_solve (tuple): A tuple containing the system of equations to solve.
 
     Returns:
-        dict: A dictionary containing the equilibrium values with keys 'x_1', 'x_2', and 'p'.
+        EquilibriumResult: The equilibrium values x_1, x_2 and p with the residual of the
+            solution and the number of Newton iterations.
 
     """
     #Initialize variables to solve for
@@ -224,14 +364,402 @@ def calculate_equilibrium(system_of_equations_to_solve):
     x_2 = symbols("x_2")
 
 
-    # Solve the system of equations
-    result = nsolve(system_of_equations_to_solve, (x_1, x_2, p), (0.5, 0.5, 1))
+    # Solve the system of equations as nsolve does, but keep the compiled system to
+    # evaluate the residual at the solution in floats
+    system = Matrix(system_of_equations_to_solve)
+
+    residual_function = lambdify((x_1, x_2, p), system, "mpmath")
+    compiled_jacobian_function = lambdify((x_1, x_2, p), system.jacobian((x_1, x_2, p)), "mpmath")
+
+    #Newton's method evaluates the Jacobian once per iteration
+    number_of_iterations = 0
+
+    def jacobian_function(*point):
+        nonlocal number_of_iterations
+        number_of_iterations += 1
+        return compiled_jacobian_function(*point)
+
+    result = [float(value) for value in findroot(residual_function, (0.5, 0.5, 1), J=jacobian_function)]
+
+    residual = max(abs(float(value)) for value in residual_function(*result))
 
-    # Store the equilibrium values in a dictionary
-    return {"x_1": result[0], "x_2": result[1], "p": result[2]}
+    return EquilibriumResult(*result, residual=residual, iterations=number_of_iterations)
 
 
-def calculate_expected_utility_log(W_0, x, prob_e_high, Return_e_high,    Return_e_low, prob_R_high, Return_R_high, Return_R_low, price):
+def calculate_all_equilibria_solution_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weight = None, number_of_starting_points = 64, holding_bounds = (-1, 2), price_bounds = None, tolerance = 1e-6, seed = 0):
+    """This function searches for all equilibria of the model with 2 agents, power
+    utility and 1 asset by starting Newton's method from many points at once.
+
+    The starting points are a Latin hypercube over the holding of agent 1 and the
+    price, together with (0.5, 0.5, 1) and (0.5, 0.5, mean return of the stock).
+    Starting points at which an agent would end up with non-positive wealth in some
+    state are dropped, and Newton steps are shortened so that wealth stays positive.
+    The system is compiled once per process, so only the Newton iterations are paid
+    for at each parameter point.
+
+    Args:
+        W_1 (float): The initial wealth of agent 1
+        W_2 (float): The initial wealth of agent 2
+        prob_e_1_high (float): The probability of the high endowment of agent 1
+        return_e_1_high (float): The return of the high endowment of agent 1
+        return_e_1_low (float): The return of the low endowment of agent 1
+        prob_e_2_high (float): The probability of the high endowment of agent 2
+        return_e_2_high (float): The return of the high endowment of agent 2
+        return_e_2_low (float): The return of the low endowment of agent 2
+        prob_R_high (float): The probability of the high return of the stock
+        return_R_high (float): The return of the high return of the stock
+        return_R_low (float): The return of the low return of the stock
+        risk_aversion_1 (float): The risk aversion parameter of agent 1
+        risk_aversion_2 (float): The risk aversion parameter of agent 2
+        variance_weight (float): The weight of the variance term in the utility function of agent 2
+        number_of_starting_points (int): The number of starting points
+        holding_bounds (tuple): The lower and upper bound for the holding of agent 1
+        price_bounds (tuple): The lower and upper bound for the price, defaults to the
+            low return of the stock and twice the mean return minus the low return
+            (capped at the high return).
+        tolerance (float): The tolerance below which two equilibria are considered equal
+        seed (int): The seed for drawing the starting points
+
+    Returns:
+        list: The equilibria sorted by price, each an EquilibriumResult with the
+            residual and the stability of the equilibrium.
+
+    """
+    residual_function, jacobian_function, is_feasible = generate_equilibrium_system_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weight)
+
+    mean_return = prob_R_high * return_R_high + (1 - prob_R_high) * return_R_low
+
+    if price_bounds is None:
+        price_bounds = (return_R_low, min(return_R_high, 2 * mean_return - return_R_low))
+
+    sample = generate_latin_hypercube_sample(number_of_starting_points, 2, seed)
+
+    holding_agent_1 = holding_bounds[0] + sample[:, 0] * (holding_bounds[1] - holding_bounds[0])
+    price = price_bounds[0] + sample[:, 1] * (price_bounds[1] - price_bounds[0])
+    starting_points = np.vstack([[0.5, 0.5, 1], [0.5, 0.5, mean_return], np.column_stack([holding_agent_1, 1 - holding_agent_1, price])])
+
+    return calculate_all_equilibria(residual_function, jacobian_function, starting_points, tolerance, is_feasible)
+
+
+POWER_UTILITY_PARAMETERS = ["W_1", "W_2", "prob_e_1_high", "return_e_1_high", "return_e_1_low", "prob_e_2_high", "return_e_2_high", "return_e_2_low", "prob_R_high", "return_R_high", "return_R_low", "risk_aversion_1", "risk_aversion_2", "variance_weight"]
+
+
+@functools.lru_cache(maxsize=None)
+def generate_numerical_system_and_jacobian_power_utility(has_variance_weight):
+    """This function compiles the system of equations for the model with 2 agents,
+    power utility and 1 asset and its Jacobian once for all parameter values.
+
+    The model parameters are arguments of the compiled functions, so a sweep derives
+    and lambdifies the system once per process instead of once per parameter point.
+
+    Args:
+        has_variance_weight (bool): Whether agent 2 puts an extra weight on the variance
+
+    Returns:
+        tuple: A function mapping points of shape (n, 3) and the values of
+            POWER_UTILITY_PARAMETERS to residuals of shape (n, 3) and a function
+            mapping the same arguments to Jacobians of shape (n, 3, 3).
+
+    """
+    variables = symbols("x_1 x_2 p")
+    parameters = symbols(POWER_UTILITY_PARAMETERS)
+
+    system_of_equations_to_solve = generate_system_of_equations_power_utility(*parameters[:-1], parameters[-1] if has_variance_weight else None)
+
+    residual_function = lambdify_vectorized(system_of_equations_to_solve, variables, parameters)
+    jacobian_expressions = lambdify_vectorized(list(Matrix(system_of_equations_to_solve).jacobian(variables)), variables, parameters)
+
+    def jacobian_function(points, *parameter_values):
+        return jacobian_expressions(points, *parameter_values).reshape(len(points), 3, 3)
+
+    return residual_function, jacobian_function
+
+
+def generate_equilibrium_system_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weight = None):
+    """This function generates the compiled system of equations for the model with 2
+    agents, power utility and 1 asset at one parameter point.
+
+    Args:
+        W_1 (float): The initial wealth of agent 1
+        W_2 (float): The initial wealth of agent 2
+        prob_e_1_high (float): The probability of the high endowment of agent 1
+        return_e_1_high (float): The return of the high endowment of agent 1
+        return_e_1_low (float): The return of the low endowment of agent 1
+        prob_e_2_high (float): The probability of the high endowment of agent 2
+        return_e_2_high (float): The return of the high endowment of agent 2
+        return_e_2_low (float): The return of the low endowment of agent 2
+        prob_R_high (float): The probability of the high return of the stock
+        return_R_high (float): The return of the high return of the stock
+        return_R_low (float): The return of the low return of the stock
+        risk_aversion_1 (float): The risk aversion parameter of agent 1
+        risk_aversion_2 (float): The risk aversion parameter of agent 2
+        variance_weight (float): The weight of the variance term in the utility function of agent 2
+
+    Returns:
+        tuple: Functions mapping points of shape (n, 3) to the residuals, to the
+            Jacobians and to whether both agents have positive wealth in every state.
+
+    """
+    residual_function, jacobian_function = generate_numerical_system_and_jacobian_power_utility(variance_weight is not None)
+
+    parameter_values = (W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weight or 0)
+
+    def is_feasible(points):
+        minimum_wealth_agent_1 = calculate_minimum_wealth(W_1, points[:, 0], return_e_1_high, return_e_1_low, return_R_high, return_R_low, points[:, 2])
+        minimum_wealth_agent_2 = calculate_minimum_wealth(W_2, points[:, 1], return_e_2_high, return_e_2_low, return_R_high, return_R_low, points[:, 2])
+        return (minimum_wealth_agent_1 > 0) & (minimum_wealth_agent_2 > 0)
+
+    return (lambda points: residual_function(points, *parameter_values)), (lambda points: jacobian_function(points, *parameter_values)), is_feasible
+
+
+def calculate_all_equilibria(residual_function, jacobian_function, starting_points, tolerance = 1e-6, is_feasible = None):
+    """This function calculates all equilibria reached from a batch of starting points.
+
+    Args:
+        residual_function (function): Maps points of shape (n, 3) to the residuals of
+            the system (first order condition agent 1, first order condition agent 2,
+            market clearing) of shape (n, 3).
+        jacobian_function (function): Maps points of shape (n, 3) to the Jacobians of
+            the system with respect to (x_1, x_2, p) of shape (n, 3, 3).
+        starting_points (np.ndarray): The starting points with columns (x_1, x_2, p).
+        tolerance (float): The tolerance below which two equilibria are considered equal
+        is_feasible (function): Optional function mapping an array of points to a
+            boolean array, used to keep Newton's method within feasible points.
+
+    Returns:
+        list: The equilibria sorted by price, each an EquilibriumResult with the
+            residual and the stability of the equilibrium.
+
+    """
+    points, converged, _ = solve_system_with_newton(lambda points: (residual_function(points), jacobian_function(points)), starting_points, is_feasible=is_feasible)
+
+    points = points[converged]
+
+    equilibria = deduplicate_equilibria(points, tolerance)
+
+    stability = classify_stability_of_equilibria(jacobian_function, equilibria)
+
+    residuals = np.abs(residual_function(equilibria)).max(axis=1) if len(equilibria) else []
+
+    return [EquilibriumResult(*point, residual=residual, stable=STABILITY_VALUES[label]) for point, residual, label in zip(equilibria, residuals, stability, strict=True)]
+
+
+def generate_numerical_system_and_jacobian(system_of_equations_to_solve):
+    """This function turns the symbolic system of equations and its Jacobian into
+    vectorized numpy functions.
+
+    Args:
+        system_of_equations_to_solve (list): The system of equations in (x_1, x_2, p).
+
+    Returns:
+        tuple: A function mapping points of shape (n, 3) to residuals of shape (n, 3) and
+            a function mapping points of shape (n, 3) to Jacobians of shape (n, 3, 3).
+
+    """
+    variables = symbols("x_1 x_2 p")
+
+    jacobian = Matrix(system_of_equations_to_solve).jacobian(variables)
+
+    residual_function = lambdify_vectorized(list(system_of_equations_to_solve), variables)
+    jacobian_expressions = lambdify_vectorized(list(jacobian), variables)
+
+    def jacobian_function(points):
+        return jacobian_expressions(points).reshape(len(points), 3, 3)
+
+    return residual_function, jacobian_function
+
+
+def lambdify_vectorized(expressions, variables, parameters = ()):
+    """This function turns a list of symbolic expressions into a numpy function which
+    evaluates all expressions at a batch of points.
+
+    Args:
+        expressions (list): The symbolic expressions.
+        variables (tuple): The sympy symbols which are passed as columns of the points.
+        parameters (tuple): Further sympy symbols which are passed as scalars.
+
+    Returns:
+        function: Maps points of shape (n, len(variables)) and the parameter values to
+            an array of shape (n, len(expressions)).
+
+    """
+    numerical_expressions = lambdify([*variables, *parameters], list(expressions), modules="numpy")
+
+    def evaluate(points, *parameter_values):
+        with np.errstate(all="ignore"):
+            values = numerical_expressions(*points.T, *parameter_values)
+        return np.stack([np.broadcast_to(np.asarray(value, dtype=float), len(points)) for value in values], axis=-1)
+
+    return evaluate
+
+
+def solve_system_with_newton(system_function, starting_points, tolerance = 1e-10, step_tolerance = 1e-10, max_iterations = 100, is_feasible = None):
+    """This function runs Newton's method from a batch of starting points at once.
+
+    A point has converged once the residuals are below the tolerance and the Newton
+    step is below the step tolerance (relative to the size of the point). Requiring a
+    small step guards against points at which the equations are merely flat, e.g. first
+    order conditions with a tiny marginal utility. If a feasibility function is given,
+    steps are halved until the new point is feasible.
+
+    Points at which the residuals are not finite, the Jacobian is singular or no
+    feasible step is found are dropped from the iteration and reported as not converged.
+
+    Args:
+        system_function (function): Maps points of shape (n, k) to the residuals of
+            shape (n, k) and the Jacobians of shape (n, k, k), evaluated together so
+            that shared terms are calculated once per iteration.
+        starting_points (np.ndarray): The starting points of shape (n, k).
+        tolerance (float): The maximal absolute residual of a converged point
+        step_tolerance (float): The maximal relative Newton step of a converged point
+        max_iterations (int): The maximal number of Newton steps
+        is_feasible (function): Optional function mapping points of shape (n, k) to a
+            boolean array.
+
+    Returns:
+        tuple: The final points of shape (n, k), a boolean array marking the converged
+            points and the number of Newton iterations of each point.
+
+    """
+    points = np.array(starting_points, dtype=float).reshape(len(starting_points), -1)
+
+    active = np.ones(len(points), dtype=bool)
+    converged = np.zeros(len(points), dtype=bool)
+    iterations = np.zeros(len(points), dtype=int)
+
+    if is_feasible is not None:
+        active &= is_feasible(points)
+
+    for _ in range(max_iterations):
+        index = np.flatnonzero(active)
+        if len(index) == 0:
+            break
+
+        residuals, jacobians = system_function(points[index])
+
+        with np.errstate(all="ignore"):
+            determinants = np.linalg.det(jacobians)
+        is_regular = np.isfinite(residuals).all(axis=1) & np.isfinite(jacobians).all(axis=(1, 2)) & np.isfinite(determinants) & (np.abs(determinants) > 1e-300)
+
+        active[index[~is_regular]] = False
+        index, residuals, jacobians = index[is_regular], residuals[is_regular], jacobians[is_regular]
+
+        with np.errstate(all="ignore"):
+            steps = np.linalg.solve(jacobians, -residuals[..., np.newaxis])[..., 0]
+
+        is_converged = (np.abs(residuals).max(axis=1, initial=0) < tolerance) & \
+            (np.abs(steps).max(axis=1, initial=0) < step_tolerance * (1 + np.abs(points[index]).max(axis=1, initial=0)))
+
+        converged[index[is_converged]] = True
+        active[index[is_converged]] = False
+        iterations[index[~is_converged]] += 1
+
+        candidates = points[index] + steps
+
+        if is_feasible is not None:
+            #Backtrack by halving the step until the new point is feasible
+            is_acceptable = is_feasible(candidates)
+            for _ in range(50):
+                if is_acceptable.all():
+                    break
+                steps[~is_acceptable] /= 2
+                candidates[~is_acceptable] = points[index[~is_acceptable]] + steps[~is_acceptable]
+                is_acceptable[~is_acceptable] = is_feasible(candidates[~is_acceptable])
+
+            active[index[~is_acceptable]] = False
+
+        points[index[~is_converged]] = candidates[~is_converged]
+
+    return points, converged, iterations
+
+
+def generate_latin_hypercube_sample(number_of_points, number_of_dimensions, seed = 0):
+    """This function draws a Latin hypercube sample on the unit cube.
+
+    Args:
+        number_of_points (int): The number of points
+        number_of_dimensions (int): The number of dimensions
+        seed (int): The seed of the random number generator
+
+    Returns:
+        np.ndarray: The sample of shape (number_of_points, number_of_dimensions).
+
+    """
+    rng = np.random.default_rng(seed)
+
+    strata = np.argsort(rng.random((number_of_dimensions, number_of_points)), axis=1).T
+
+    return (strata + rng.random((number_of_points, number_of_dimensions))) / number_of_points
+
+
+def calculate_minimum_wealth(W_0, x, Return_e_high, Return_e_low, Return_R_high, Return_R_low, price):
+    """This function calculates the lowest final wealth of an agent across all states.
+
+    Args:
+        W_0 (float): The initial wealth of the agent
+        x (float or np.ndarray): The holding of the stock
+        Return_e_high (float): The return of the high endowment
+        Return_e_low (float): The return of the low endowment
+        Return_R_high (float): The return of the high return of the stock
+        Return_R_low (float): The return of the low return of the stock
+        price (float or np.ndarray): The price of the stock
+
+    Returns:
+        float or np.ndarray: The lowest final wealth of the agent
+
+    """
+    return W_0 + min(Return_e_high, Return_e_low) + np.minimum(x * (Return_R_high - price), x * (Return_R_low - price))
+
+
+def deduplicate_equilibria(points, tolerance = 1e-6):
+    """This function merges equilibria which are equal up to a tolerance.
+
+    Args:
+        points (np.ndarray): The converged points of shape (n, 3) with columns (x_1, x_2, p).
+        tolerance (float): The maximal absolute difference of two equal equilibria
+
+    Returns:
+        np.ndarray: The distinct equilibria sorted by price.
+
+    """
+    unique_points = []
+
+    for point in points[np.argsort(points[:, 2])]:
+        if not any(np.abs(point - unique_point).max() < tolerance for unique_point in unique_points):
+            unique_points.append(point)
+
+    return np.array(unique_points).reshape(-1, points.shape[1])
+
+
+def classify_stability_of_equilibria(jacobian_function, equilibria):
+    """This function classifies equilibria by their Walrasian (tatonnement) stability.
+
+    The demand of each agent is given implicitly by its first order condition, so the
+    slope of the excess demand in the price follows from the implicit function theorem.
+    An equilibrium is stable if excess demand falls in the price.
+
+    Args:
+        jacobian_function (function): Maps points of shape (n, 3) to the Jacobians of
+            the system (first order condition agent 1, first order condition agent 2,
+            market clearing) with respect to (x_1, x_2, p).
+        equilibria (np.ndarray): The equilibria of shape (n, 3).
+
+    Returns:
+        list: 'stable', 'unstable' or 'degenerate' for each equilibrium.
+
+    """
+    if len(equilibria) == 0:
+        return []
+
+    jacobians = jacobian_function(equilibria)
+
+    with np.errstate(all="ignore"):
+        slope_excess_demand = -jacobians[:, 0, 2] / jacobians[:, 0, 0] - jacobians[:, 1, 2] / jacobians[:, 1, 1]
+
+    return ["stable" if slope < 0 else "unstable" if slope > 0 else "degenerate" for slope in slope_excess_demand]
+
+
+def calculate_expected_utility_log(W_0, x, prob_e_high, Return_e_high,    Return_e_low, prob_R_high, Return_R_high, Return_R_low, price, log_function = math.log):
     """This function calculates the expected utility of an agent with log utility and 1
     asset.
 
@@ -245,15 +773,16 @@ def calculate_expected_utility_log(W_0, x, prob_e_high, Return_e_high,    Return
         Return_R_high (float): The return of the high return of the stock
         Return_R_low (float): The return of the low return of the stock
         p (float): The price of the stock
+        log_function (function): The logarithm to use, e.g. sympy.log for symbolic x and price
 
     Returns:
         float: The expected utility of the agent
 
     """
-    return prob_e_high * prob_R_high * math.log(W_0 + Return_e_high + x *(Return_R_high - price)) + \
-               prob_e_high * (1 - prob_R_high) * math.log(W_0 + Return_e_high + x * (Return_R_low - price)) + \
-              (1 - prob_e_high) * prob_R_high * math.log(W_0 + Return_e_low + x * (Return_R_high - price)) + \
-             (1 - prob_e_high) * (1 - prob_R_high) * math.log(W_0 + Return_e_low + x * (Return_R_low - price))
+    return prob_e_high * prob_R_high * log_function(W_0 + Return_e_high + x *(Return_R_high - price)) + \
+               prob_e_high * (1 - prob_R_high) * log_function(W_0 + Return_e_high + x * (Return_R_low - price)) + \
+              (1 - prob_e_high) * prob_R_high * log_function(W_0 + Return_e_low + x * (Return_R_high - price)) + \
+             (1 - prob_e_high) * (1 - prob_R_high) * log_function(W_0 + Return_e_low + x * (Return_R_low - price))
 
 
 def calculate_expected_utility_power(W_0, x, prob_e_high, Return_e_high,    Return_e_low, prob_R_high, Return_R_high, Return_R_low, price, gamma):
@@ -283,6 +812,44 @@ def calculate_expected_utility_power(W_0, x, prob_e_high, Return_e_high,    Retu
 
 
 
+def calculate_certainty_equivalent_power(W_0, x, prob_e_high, Return_e_high, Return_e_low, prob_R_high, Return_R_high, Return_R_low, price, gamma):
+    """This function calculates the certainty equivalent wealth of an agent with power
+    utility and 1 asset.
+
+    Unlike the expected utility, the certainty equivalent is continuous in gamma and in
+    units of wealth for every gamma, so it can be compared across agents with different
+    risk aversion. Within 1e-3 of gamma = 1 the power formula loses precision, so the
+    logarithm of the certainty equivalent is expanded there to second order in
+    1 - gamma around its log utility limit. The arguments can be sympy expressions.
+
+    Args:
+        W_0 (float): The initial wealth of the agent
+        x (float): The fraction of wealth invested in the stock
+        prob_e_high (float): The probability of the high endowment
+        Return_e_high (float): The return of the high endowment
+        Return_2_low (float): The return of the low endowment
+        Prob_R_high (float): The probability of the high return of the stock
+        Return_R_high (float): The return of the high return of the stock
+        Return_R_low (float): The return of the low return of the stock
+        price (float): The price of the stock
+        gamma (float): The risk aversion parameter
+
+    Returns:
+        sympy expression: The certainty equivalent wealth of the agent
+
+    """
+    probabilities = [prob_e_high * prob_R_high, prob_e_high * (1 - prob_R_high), (1 - prob_e_high) * prob_R_high, (1 - prob_e_high) * (1 - prob_R_high)]
+    wealth = [W_0 + Return_e_high + x * (Return_R_high - price), W_0 + Return_e_high + x * (Return_R_low - price), W_0 + Return_e_low + x * (Return_R_high - price), W_0 + Return_e_low + x * (Return_R_low - price)]
+
+    mean_log_wealth = sum(probability * log(state_wealth) for probability, state_wealth in zip(probabilities, wealth, strict=True))
+    variance_log_wealth = sum(probability * (log(state_wealth) - mean_log_wealth) ** 2 for probability, state_wealth in zip(probabilities, wealth, strict=True))
+
+    log_certainty_equivalent_near_log_utility = mean_log_wealth + (1 - gamma) / 2 * variance_log_wealth
+    log_certainty_equivalent_power_utility = log(sum(probability * state_wealth ** (1 - gamma) for probability, state_wealth in zip(probabilities, wealth, strict=True))) / (1 - gamma)
+
+    return exp(Piecewise((log_certainty_equivalent_near_log_utility, Abs(1 - gamma) < 1e-3), (log_certainty_equivalent_power_utility, True)))
+
+
 def calculate_variance_for_bernoulli_stock(prob_high, prob_low, R_high, R_low):
     """This function calculates the variance of a Bernoulli distributed stock.
 
@@ -300,7 +867,288 @@ def calculate_variance_for_bernoulli_stock(prob_high, prob_low, R_high, R_low):
 
 
 
-def sensitivity_analysis_variance_weight(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2):
+def discretize_bernoulli_distribution(prob_high, return_high, return_low):
+    """This function represents a two-point distribution by its nodes and weights.
+
+    Args:
+        prob_high (float): The probability of the high return
+        return_high (float): The high return
+        return_low (float): The low return
+
+    Returns:
+        dict: The distribution with keys 'nodes' and 'weights'.
+
+    """
+    return {"nodes": np.array([return_high, return_low], dtype=float), "weights": np.array([prob_high, 1 - prob_high], dtype=float)}
+
+
+def discretize_lognormal_distribution(mean_log, std_log, number_of_nodes = 16, shift = 0):
+    """This function discretizes a (shifted) lognormal distribution with Gauss-Hermite
+    quadrature.
+
+    Expectations of smooth functions are exact up to polynomials of degree
+    2 * number_of_nodes - 1 in the underlying normal variable, so more nodes trade
+    speed for accuracy in the tails.
+
+    Args:
+        mean_log (float): The mean of the logarithm
+        std_log (float): The standard deviation of the logarithm
+        number_of_nodes (int): The number of quadrature nodes
+        shift (float): A constant added to every node
+
+    Returns:
+        dict: The distribution with keys 'nodes' and 'weights'.
+
+    """
+    standard_normal_nodes, weights = np.polynomial.hermite_e.hermegauss(number_of_nodes)
+
+    return {"nodes": shift + np.exp(mean_log + std_log * standard_normal_nodes), "weights": weights / weights.sum()}
+
+
+def discretize_mixture_distribution(distributions, probabilities):
+    """This function combines discretized distributions into their mixture, e.g. a
+    lognormal body and a rare lottery-like jackpot.
+
+    Args:
+        distributions (list): The distributions, each a dict with keys 'nodes' and 'weights'.
+        probabilities (list): The probability of each component.
+
+    Returns:
+        dict: The distribution with keys 'nodes' and 'weights'.
+
+    """
+    nodes = np.concatenate([distribution["nodes"] for distribution in distributions])
+    weights = np.concatenate([probability * distribution["weights"] for distribution, probability in zip(distributions, probabilities, strict=True)])
+
+    return {"nodes": nodes, "weights": weights / weights.sum()}
+
+
+def calculate_moments_of_distribution(distribution):
+    """This function calculates the mean, variance and skewness from the quadrature
+    nodes of a distribution.
+
+    Args:
+        distribution (dict): The distribution with keys 'nodes' and 'weights'.
+
+    Returns:
+        dict: The moments with keys 'mean', 'variance' and 'skewness'.
+
+    """
+    mean = distribution["weights"] @ distribution["nodes"]
+    deviations = distribution["nodes"] - mean
+    variance = distribution["weights"] @ deviations ** 2
+    skewness = distribution["weights"] @ deviations ** 3 / variance ** 1.5
+
+    return {"mean": mean, "variance": variance, "skewness": skewness}
+
+
+def generate_joint_distribution(endowment_distribution, stock_distribution):
+    """This function generates the joint nodes of an independent endowment and stock.
+
+    Args:
+        endowment_distribution (dict): The distribution of the endowment.
+        stock_distribution (dict): The distribution of the stock return.
+
+    Returns:
+        tuple: The flattened endowment nodes, stock nodes and joint weights.
+
+    """
+    endowment_nodes, stock_nodes = np.meshgrid(endowment_distribution["nodes"], stock_distribution["nodes"], indexing="ij")
+
+    weights = np.outer(endowment_distribution["weights"], stock_distribution["weights"])
+
+    return endowment_nodes.ravel(), stock_nodes.ravel(), weights.ravel()
+
+
+def calculate_expected_utility_power_distribution(W_0, x, price, gamma, endowment_distribution, stock_distribution):
+    """This function calculates the expected power utility (log utility for gamma = 1)
+    of an agent whose endowment and stock return follow discretized distributions.
+
+    Args:
+        W_0 (float): The initial wealth of the agent
+        x (float or np.ndarray): The holding of the stock
+        price (float or np.ndarray): The price of the stock
+        gamma (float): The risk aversion parameter
+        endowment_distribution (dict): The distribution of the endowment.
+        stock_distribution (dict): The distribution of the stock return.
+
+    Returns:
+        float or np.ndarray: The expected utility of the agent
+
+    """
+    endowment_nodes, stock_nodes, weights = generate_joint_distribution(endowment_distribution, stock_distribution)
+
+    wealth = W_0 + endowment_nodes + np.expand_dims(x, -1) * (stock_nodes - np.expand_dims(price, -1))
+
+    utility = np.log(wealth) if gamma == 1 else wealth ** (1 - gamma) / (1 - gamma)
+
+    return utility @ weights
+
+
+def calculate_optimization_condition_power_utility_distribution(W, x, price, gamma, endowment_distribution, stock_distribution):
+    """This function calculates the first order condition of an agent with power
+    utility whose endowment and stock return follow discretized distributions, together
+    with its derivatives in the holding and in the price.
+
+    States with non-positive wealth make the condition NaN.
+
+    Args:
+        W (float): The initial wealth of the agent
+        x (np.ndarray): The holdings of the stock
+        price (np.ndarray): The prices of the stock
+        gamma (float): The risk aversion parameter
+        endowment_distribution (dict): The distribution of the endowment.
+        stock_distribution (dict): The distribution of the stock return.
+
+    Returns:
+        tuple: The first order condition and its derivatives in x and in the price.
+
+    """
+    endowment_nodes, stock_nodes, weights = generate_joint_distribution(endowment_distribution, stock_distribution)
+
+    excess_return = stock_nodes - price[:, np.newaxis]
+    wealth = W + endowment_nodes + x[:, np.newaxis] * excess_return
+
+    with np.errstate(all="ignore"):
+        marginal_utility = np.where(wealth > 0, wealth, np.nan) ** (-gamma)
+        marginal_utility_slope = -gamma * marginal_utility / wealth
+
+    condition = (marginal_utility * excess_return) @ weights
+    derivative_x = (marginal_utility_slope * excess_return ** 2) @ weights
+    derivative_price = (-marginal_utility_slope * x[:, np.newaxis] * excess_return - marginal_utility) @ weights
+
+    return condition, derivative_x, derivative_price
+
+
+def calculate_equilibrium_solution_power_utility_distribution(W_1, W_2, endowment_distribution_1, endowment_distribution_2, stock_distribution, risk_aversion_1, risk_aversion_2, variance_weight = None, skewness_weight = None, starting_points = None, number_of_starting_points = 32, holding_bounds = (-1, 2), seed = 0):
+    """This function calculates the equilibrium solution for the model with 2 agents,
+    power utility and 1 asset whose endowments and return follow discretized
+    distributions.
+
+    As in the two-point model, agent 2 can put an extra weight on the variance or the
+    skewness of the stock, which are calculated from the same quadrature nodes.
+
+    Newton's method runs from all starting points at once and steps are shortened so
+    that both agents keep positive wealth at every node. The equilibrium reached from
+    the first converging starting point is returned.
+
+    Args:
+        W_1 (float): The initial wealth of agent 1
+        W_2 (float): The initial wealth of agent 2
+        endowment_distribution_1 (dict): The distribution of the endowment of agent 1.
+        endowment_distribution_2 (dict): The distribution of the endowment of agent 2.
+        stock_distribution (dict): The distribution of the stock return.
+        risk_aversion_1 (float): The risk aversion parameter of agent 1
+        risk_aversion_2 (float): The risk aversion parameter of agent 2
+        variance_weight (float): The weight of the variance term in the utility function of agent 2
+        skewness_weight (float): The weight of the skewness term in the utility function of agent 2
+        starting_points (np.ndarray): The starting points (x_1, x_2, p), defaults to
+            (0.5, 0.5, 1), (0.5, 0.5, mean return of the stock) and a Latin hypercube
+            over the holding of agent 1 and the price as in
+            calculate_all_equilibria_solution_power_utility.
+        number_of_starting_points (int): The size of the default Latin hypercube
+        holding_bounds (tuple): The lower and upper bound for the holding of agent 1 in
+            the default Latin hypercube
+        seed (int): The seed for drawing the default Latin hypercube
+
+    Returns:
+        EquilibriumResult: The equilibrium solution with (x_1, x_2, p) and the expected
+            utilities of both agents
+
+    """
+    moments = calculate_moments_of_distribution(stock_distribution)
+
+    preference_term = (variance_weight or 0) * moments["variance"] + (skewness_weight or 0) * moments["skewness"]
+
+    lowest_return, highest_return = stock_distribution["nodes"].min(), stock_distribution["nodes"].max()
+
+    if starting_points is None:
+        sample = generate_latin_hypercube_sample(number_of_starting_points, 2, seed)
+
+        holding_agent_1 = holding_bounds[0] + sample[:, 0] * (holding_bounds[1] - holding_bounds[0])
+        price = lowest_return + sample[:, 1] * (min(highest_return, 2 * moments["mean"] - lowest_return) - lowest_return)
+        starting_points = np.vstack([[0.5, 0.5, 1], [0.5, 0.5, moments["mean"]], np.column_stack([holding_agent_1, 1 - holding_agent_1, price])])
+
+    def is_feasible(points):
+        #The lowest wealth across nodes is reached at the extreme endowment and stock nodes
+        minimum_wealth_agent_1 = calculate_minimum_wealth(W_1, points[:, 0], endowment_distribution_1["nodes"].max(), endowment_distribution_1["nodes"].min(), highest_return, lowest_return, points[:, 2])
+        minimum_wealth_agent_2 = calculate_minimum_wealth(W_2, points[:, 1], endowment_distribution_2["nodes"].max(), endowment_distribution_2["nodes"].min(), highest_return, lowest_return, points[:, 2])
+        return (minimum_wealth_agent_1 > 0) & (minimum_wealth_agent_2 > 0)
+
+    def evaluate(points):
+        condition_1, derivative_x_1, derivative_price_1 = calculate_optimization_condition_power_utility_distribution(W_1, points[:, 0], points[:, 2], risk_aversion_1, endowment_distribution_1, stock_distribution)
+        condition_2, derivative_x_2, derivative_price_2 = calculate_optimization_condition_power_utility_distribution(W_2, points[:, 1], points[:, 2], risk_aversion_2, endowment_distribution_2, stock_distribution)
+
+        residuals = np.column_stack([condition_1, condition_2 + preference_term, points[:, 0] + points[:, 1] - 1])
+
+        zeros, ones = np.zeros(len(points)), np.ones(len(points))
+        jacobians = np.stack([
+            np.column_stack([derivative_x_1, zeros, derivative_price_1]),
+            np.column_stack([zeros, derivative_x_2, derivative_price_2]),
+            np.column_stack([ones, ones, zeros]),
+        ], axis=1)
+
+        return residuals, jacobians
+
+    points, converged, iterations = solve_system_with_newton(evaluate, starting_points, is_feasible=is_feasible)
+
+    if not converged.any():
+        info = "The equilibrium could not be found from the given starting points."
+        raise ValueError(info)
+
+    x_1, x_2, price = points[converged][0]
+
+    residuals, _ = evaluate(points[converged][:1])
+
+    utility_agent_1 = calculate_expected_utility_power_distribution(W_1, x_1, price, risk_aversion_1, endowment_distribution_1, stock_distribution)
+    utility_agent_2 = calculate_expected_utility_power_distribution(W_2, x_2, price, risk_aversion_2, endowment_distribution_2, stock_distribution)
+
+    return EquilibriumResult(x_1, x_2, price, utility_agent_1, utility_agent_2, residual=np.abs(residuals).max(), iterations=iterations[converged][0])
+
+
+def calculate_equilibrium_result_power_utility(model_run_configuration):
+    """This function calculates the equilibrium and the expected utilities of both
+    agents for one model run configuration with power utility.
+
+    Args:
+        model_run_configuration (dict): The parameters with the keys of
+            MODEL_RUN_CONFIGURATION.
+
+    Returns:
+        EquilibriumResult: The equilibrium with the expected utilities of both agents.
+
+    """
+    result = calculate_equilibrium_solution_power_utility(
+    W_1 = model_run_configuration["Initial_Wealth_Agent_1"],
+    W_2 = model_run_configuration["Intial_Wealth_Agent_2"],
+    prob_e_1_high = model_run_configuration["Endowment_Probability_High_Agent_1"], return_e_1_high=model_run_configuration["Endowment_Payoff_High_Agent_1"],
+    return_e_1_low = model_run_configuration["Endowment_Payoff_Low_Agent_1"], prob_e_2_high = model_run_configuration["Endowment_Probability_High_Agent_2"],
+    return_e_2_high = model_run_configuration["Endowment_Payoff_High_Agent_2"],
+    return_e_2_low = model_run_configuration["Endowment_Payoff_Low_Agent_2"], prob_R_high = model_run_configuration["Stock_Probability_High"], return_R_high = model_run_configuration["Stock_Payoff_High"],
+    return_R_low = model_run_configuration["Stock_Payoff_Low"],
+    risk_aversion_1=model_run_configuration["Risk_Aversion_Agent_1"],
+    risk_aversion_2=model_run_configuration["Risk_Aversion_Agent_2"],
+    variance_weight=model_run_configuration["Variance_Weight"])
+
+    result.utility_agent_1 = calculate_expected_utility_power(
+    W_0 = model_run_configuration["Initial_Wealth_Agent_1"], x = result.x_1, prob_e_high = model_run_configuration["Endowment_Probability_High_Agent_1"],
+    Return_e_high = model_run_configuration["Endowment_Payoff_High_Agent_1"], Return_e_low = model_run_configuration["Endowment_Payoff_Low_Agent_1"], prob_R_high = model_run_configuration["Stock_Probability_High"], Return_R_high = model_run_configuration["Stock_Payoff_High"],
+    Return_R_low = model_run_configuration["Stock_Payoff_Low"],
+    price=result.p,
+    gamma=model_run_configuration["Risk_Aversion_Agent_1"])
+
+    result.utility_agent_2 = calculate_expected_utility_power(
+    W_0 = model_run_configuration["Intial_Wealth_Agent_2"],
+    x = result.x_2, prob_e_high = model_run_configuration["Endowment_Probability_High_Agent_2"],
+    Return_e_high = model_run_configuration["Endowment_Payoff_High_Agent_2"], Return_e_low = model_run_configuration["Endowment_Payoff_Low_Agent_2"], prob_R_high = model_run_configuration["Stock_Probability_High"], Return_R_high = model_run_configuration["Stock_Payoff_High"],
+    Return_R_low = model_run_configuration["Stock_Payoff_Low"],
+    price=result.p,
+    gamma=model_run_configuration["Risk_Aversion_Agent_2"])
+
+    return result
+
+
+def sensitivity_analysis_variance_weight(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, detect_multiple_equilibria = False):
     """This function generates a sensitivity analysis for the variance weight in the
     power utility model.
 
@@ -318,33 +1166,59 @@ def sensitivity_analysis_variance_weight(W_1, W_2, prob_e_1_high, return_e_1_hig
         return_R_low (float): The return of the low return of the stock
         risk_aversion_1 (float): The risk aversion parameter of agent 1
         risk_aversion_2 (float): The risk aversion parameter of agent 2
+        detect_multiple_equilibria (bool): Whether to run the multi-start search at every
+            variance weight and add the column "Number_Of_Equilibria". The single start
+            (0.5, 0.5, 1) is then solved with the compiled system of the search. Where
+            it fails, the row takes the lowest price equilibrium of the search, or stays
+            NaN with "Converged" 0 if there is none.
 
     Returns:
         pd.DataFrame: A dataframe containing the sensitivity analysis for the variance weight
-            columns: "Variance_Weight", "x_1", "x_2", "p", "Utility_Agent_1", "Utility_Agent_2".
+            columns: "Variance_Weight" and EQUILIBRIUM_RESULT_COLUMNS.
 
     """
     #Initialize empty arrays
     variance_weights_agent_2 = np.arange(0, 0.01, 0.001)
 
-    holding_stock_agent_1 = np.zeros(len(variance_weights_agent_2))
-    holding_stock_agent_2 = np.zeros(len(variance_weights_agent_2))
-    price = np.zeros(len(variance_weights_agent_2))
-    utility_agent_1 = np.zeros(len(variance_weights_agent_2))
-    utility_agent_2 = np.zeros(len(variance_weights_agent_2))
+    results = allocate_equilibrium_results(len(variance_weights_agent_2))
+    number_of_equilibria = np.zeros(len(variance_weights_agent_2), dtype=int)
 
     for i in range(len(variance_weights_agent_2)):
-        result = calculate_equilibrium_solution_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weights_agent_2[i])
+        if detect_multiple_equilibria:
+            equilibria = calculate_all_equilibria_solution_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weights_agent_2[i])
+            number_of_equilibria[i] = len(equilibria)
+
+            residual_function, jacobian_function, is_feasible = generate_equilibrium_system_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weights_agent_2[i])
+
+            points, converged, iterations = solve_system_with_newton(lambda points: (residual_function(points), jacobian_function(points)), [(0.5, 0.5, 1)], is_feasible=is_feasible)
+
+            if not equilibria:
+                results[i, EQUILIBRIUM_RESULT_COLUMNS.index("Converged")] = 0
+                continue
+
+            #Take the equilibrium reached from the single start, else the one with the lowest price
+            if converged[0]:
+                result = min(equilibria, key=lambda equilibrium: np.abs(equilibrium.to_array()[:3] - points[0]).max())
+                result.iterations = iterations[0]
+            else:
+                result = equilibria[0]
+
+        else:
+            result = calculate_equilibrium_solution_power_utility(W_1, W_2, prob_e_1_high, return_e_1_high, return_e_1_low, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, risk_aversion_1, risk_aversion_2, variance_weights_agent_2[i])
+
+        result.utility_agent_1 = calculate_expected_utility_power(W_1, result.x_1, prob_e_1_high, return_e_1_high, return_e_1_low, prob_R_high, return_R_high, return_R_low, result.p, risk_aversion_1)
+
+        result.utility_agent_2 = calculate_expected_utility_power(W_2, result.x_2, prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, result.p, risk_aversion_2)
 
-        holding_stock_agent_1[i] = result["x_1"]
-        holding_stock_agent_2[i] = result["x_2"]
-        price[i] = result["p"]
+        results[i] = result.to_array()
 
-        utility_agent_1[i] = calculate_expected_utility_power(W_1, holding_stock_agent_1[i], prob_e_1_high, return_e_1_high, return_e_1_low, prob_R_high, return_R_high, return_R_low, price[i], risk_aversion_1)
+    output = equilibrium_results_to_dataframe(results)
+    output.insert(0, "Variance_Weight", variance_weights_agent_2)
 
-        utility_agent_2[i] = calculate_expected_utility_power(W_2, holding_stock_agent_2[i], prob_e_2_high, return_e_2_high, return_e_2_low, prob_R_high, return_R_high, return_R_low, price[i], risk_aversion_2)
+    if detect_multiple_equilibria:
+        output["Number_Of_Equilibria"] = number_of_equilibria
 
-    return pd.DataFrame({"Variance_Weight": variance_weights_agent_2, "x_1": holding_stock_agent_1, "x_2": holding_stock_agent_2, "p": price, "Utility_Agent_1": utility_agent_1, "Utility_Agent_2": utility_agent_2})
+    return output
 
 
 import plotly.graph_objects as go
@@ -0,0 +1,471 @@
+"""Functions for running parameter sweeps through a file-based work queue.
+
+A coordinator splits the sweep grid into shards in a shared directory. Any number of
+workers, on any host which sees the directory, claim shards by atomically renaming
+them, solve them and write one result fragment per shard. The lease of a claim is
+encoded in the name of the claimed file, so claiming and renewing a lease are each a
+single atomic rename and expired leases can be reclaimed by any worker. Lease expiry
+uses wall-clock time, so the clocks of the hosts should be roughly in sync.
+
+Each model run is stopped after a time limit, and a shard whose lease has expired
+too often (e.g. because it crashes or hangs its workers) is moved to the failed
+directory with all its runs marked as not converged, so that a single bad shard
+cannot stall the sweep.
+
+The queue directory has the layout
+
+    manifest.json
+    pending/shard_00000.csv
+    pending/shard_00000__<expired leases>.csv
+    claimed/shard_00000__<worker id>__<lease expiry in ms>__<attempt>.csv
+    failed/shard_00000.csv
+    results/shard_00000.csv
+
+where the manifest lists the shards written by the coordinator, so that merging can
+check that no result fragment is missing or left over from another sweep.
+
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import signal
+import socket
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from theory_model_stock_gambling.config import MODEL_RUN_CONFIGURATION
+from theory_model_stock_gambling.model_functions import (
+    EQUILIBRIUM_RESULT_COLUMNS,
+    allocate_equilibrium_results,
+    calculate_equilibrium_result_power_utility,
+    equilibrium_results_to_dataframe,
+)
+
+LEASE_SEPARATOR = "__"
+MANIFEST_NAME = "manifest.json"
+
+
+def generate_sweep_grid(parameter_ranges):
+    """This function generates the cartesian product of parameter values.
+
+    Args:
+        parameter_ranges (dict): Maps keys of MODEL_RUN_CONFIGURATION to the values to sweep over.
+
+    Returns:
+        pd.DataFrame: One row per combination, one column per parameter.
+
+    """
+    return pd.DataFrame(list(itertools.product(*parameter_ranges.values())), columns=list(parameter_ranges))
+
+
+def write_sweep_shards(grid, queue_directory, shard_size = 100, base_configuration = MODEL_RUN_CONFIGURATION):
+    """This function writes the sweep grid as shards into the pending directory of a
+    new work queue, together with a manifest listing the shards.
+
+    Parameters which are not in the grid are filled in from the base configuration, so
+    every shard holds complete model run configurations. A queue directory can only be
+    used for one sweep, so directories which already hold a manifest, shards or results
+    are refused.
+
+    Args:
+        grid (pd.DataFrame): The parameter combinations, one row per model run.
+        queue_directory (str or pathlib.Path): The shared queue directory.
+        shard_size (int): The number of model runs per shard.
+        base_configuration (dict): The values of all parameters not in the grid.
+
+    Returns:
+        int: The number of shards.
+
+    """
+    queue_directory = Path(queue_directory)
+
+    for subdirectory in ["pending", "claimed", "failed", "results"]:
+        (queue_directory / subdirectory).mkdir(parents=True, exist_ok=True)
+
+    if (queue_directory / MANIFEST_NAME).exists() or any(any((queue_directory / subdirectory).iterdir()) for subdirectory in ["pending", "claimed", "failed", "results"]):
+        info = f"The queue directory {queue_directory} already holds a sweep, use a new directory."
+        raise ValueError(info)
+
+    grid = grid.assign(**{key: value for key, value in base_configuration.items() if key not in grid})
+
+    number_of_shards = max(1, -(-len(grid) // shard_size))
+    shard_names = [f"shard_{shard_number:05d}" for shard_number in range(number_of_shards)]
+
+    #The manifest is written first so a partially written queue is never mistaken for an empty one
+    write_manifest({"number_of_shards": number_of_shards, "number_of_runs": len(grid), "shards": shard_names}, queue_directory / MANIFEST_NAME)
+
+    for shard_number, shard_name in enumerate(shard_names):
+        shard = grid.iloc[shard_number * shard_size:(shard_number + 1) * shard_size]
+        write_file_atomically(shard, queue_directory / "pending" / f"{shard_name}.csv")
+
+    return number_of_shards
+
+
+def write_manifest(manifest, path):
+    """This function writes the manifest of a sweep such that readers never see a
+    partial file.
+
+    Args:
+        manifest (dict): The number of shards, the number of runs and the shard names.
+        path (pathlib.Path): The final path.
+
+    """
+    temporary_path = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    temporary_path.write_text(json.dumps(manifest, indent=2))
+    os.replace(temporary_path, path)
+
+
+def write_file_atomically(data, path):
+    """This function writes a dataframe to csv such that readers never see a partial
+    file.
+
+    Args:
+        data (pd.DataFrame): The data to write.
+        path (pathlib.Path): The final path.
+
+    """
+    temporary_path = path.with_name(f".{path.name}.{socket.gethostname()}.{os.getpid()}.tmp")
+    data.to_csv(temporary_path, index_label="Run")
+    os.replace(temporary_path, path)
+
+
+def generate_claimed_path(queue_directory, shard_name, worker_id, lease_seconds, attempt):
+    """This function generates the path of a claimed shard, encoding the worker, the
+    expiry of the lease and the number of the attempt to solve the shard.
+    """
+    expiry = int((time.time() + lease_seconds) * 1000)
+    return Path(queue_directory) / "claimed" / f"{shard_name}{LEASE_SEPARATOR}{worker_id}{LEASE_SEPARATOR}{expiry}{LEASE_SEPARATOR}{attempt}.csv"
+
+
+def parse_claimed_path(claimed_path):
+    """This function parses the shard name, the worker id, the lease expiry (in
+    seconds) and the number of the attempt from the path of a claimed shard.
+    """
+    shard_name, worker_id, expiry, attempt = Path(claimed_path).stem.split(LEASE_SEPARATOR)
+    return shard_name, worker_id, int(expiry) / 1000, int(attempt)
+
+
+def parse_pending_path(pending_path):
+    """This function parses the shard name and the number of expired leases from the
+    path of a pending shard.
+    """
+    shard_name, *expired_leases = Path(pending_path).stem.split(LEASE_SEPARATOR)
+    return shard_name, int(expired_leases[0]) if expired_leases else 0
+
+
+def claim_shard(queue_directory, worker_id, lease_seconds = 600):
+    """This function claims a pending shard for a worker.
+
+    Shards whose results already exist (e.g. because a lease expired while the result
+    was being written) are discarded instead of being returned.
+
+    Args:
+        queue_directory (str or pathlib.Path): The shared queue directory.
+        worker_id (str): The id of the worker, must not contain LEASE_SEPARATOR.
+        lease_seconds (float): The duration of the lease.
+
+    Returns:
+        pathlib.Path or None: The path of the claimed shard, None if no shard is pending.
+
+    """
+    queue_directory = Path(queue_directory)
+
+    for pending_path in sorted((queue_directory / "pending").glob("shard_*.csv")):
+        shard_name, expired_leases = parse_pending_path(pending_path)
+        claimed_path = generate_claimed_path(queue_directory, shard_name, worker_id, lease_seconds, expired_leases + 1)
+
+        try:
+            os.rename(pending_path, claimed_path)
+        except FileNotFoundError:
+            #Another worker claimed the shard first
+            continue
+
+        if (queue_directory / "results" / f"{shard_name}.csv").exists():
+            release_shard(claimed_path)
+            continue
+
+        return claimed_path
+
+    return None
+
+
+def renew_lease(claimed_path, lease_seconds = 600):
+    """This function extends the lease of a claimed shard.
+
+    Args:
+        claimed_path (pathlib.Path): The current path of the claimed shard.
+        lease_seconds (float): The duration of the new lease from now on.
+
+    Returns:
+        pathlib.Path or None: The new path of the claimed shard, None if the lease was
+            lost because it expired and the shard was reclaimed.
+
+    """
+    shard_name, worker_id, _, attempt = parse_claimed_path(claimed_path)
+    renewed_path = generate_claimed_path(claimed_path.parent.parent, shard_name, worker_id, lease_seconds, attempt)
+
+    try:
+        os.rename(claimed_path, renewed_path)
+    except FileNotFoundError:
+        return None
+
+    return renewed_path
+
+
+def release_shard(claimed_path):
+    """This function removes a claimed shard once it is no longer needed."""
+    try:
+        os.remove(claimed_path)
+    except FileNotFoundError:
+        pass
+
+
+def reclaim_expired_leases(queue_directory, max_attempts = 3):
+    """This function moves claimed shards whose lease has expired back to pending.
+
+    Shards whose lease has expired max_attempts times are moved to the failed directory
+    instead, and their result fragment is written with every run marked as not
+    converged. A worker which still finishes such a shard later overwrites the
+    fragment with its results.
+
+    Args:
+        queue_directory (str or pathlib.Path): The shared queue directory.
+        max_attempts (int): The number of expired leases after which a shard fails.
+
+    Returns:
+        int: The number of reclaimed shards, including failed shards.
+
+    """
+    queue_directory = Path(queue_directory)
+
+    number_of_reclaimed_shards = 0
+
+    for claimed_path in (queue_directory / "claimed").glob("shard_*.csv"):
+        shard_name, _, expiry, attempt = parse_claimed_path(claimed_path)
+
+        if expiry >= time.time():
+            continue
+
+        has_failed = attempt >= max_attempts
+
+        if has_failed:
+            reclaimed_path = queue_directory / "failed" / f"{shard_name}.csv"
+        else:
+            reclaimed_path = queue_directory / "pending" / f"{shard_name}{LEASE_SEPARATOR}{attempt}.csv"
+
+        try:
+            os.rename(claimed_path, reclaimed_path)
+        except FileNotFoundError:
+            #The shard was finished, renewed or reclaimed in the meantime
+            continue
+
+        results_path = queue_directory / "results" / f"{shard_name}.csv"
+
+        if has_failed and not results_path.exists():
+            write_file_atomically(generate_failed_shard_output(pd.read_csv(reclaimed_path, index_col="Run")), results_path)
+
+        number_of_reclaimed_shards += 1
+
+    return number_of_reclaimed_shards
+
+
+def generate_failed_shard_output(shard):
+    """This function appends NaN results with Converged set to 0 to every model run of
+    a shard.
+    """
+    results = allocate_equilibrium_results(len(shard))
+    results[:, EQUILIBRIUM_RESULT_COLUMNS.index("Converged")] = 0
+
+    return pd.concat([shard, equilibrium_results_to_dataframe(results, index=shard.index)], axis=1)
+
+
+@contextlib.contextmanager
+def limit_run_time(seconds):
+    """This function raises a TimeoutError in the enclosed block after a number of
+    seconds.
+
+    The limit uses SIGALRM, so it only applies on Unix in the main thread and only
+    interrupts Python code. Elsewhere, or if seconds is None, the block is not limited.
+
+    Args:
+        seconds (float): The time limit.
+
+    """
+    if seconds is None or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def raise_timeout(signal_number, frame):
+        info = f"The model run took longer than {seconds} seconds."
+        raise TimeoutError(info)
+
+    previous_handler = signal.signal(signal.SIGALRM, raise_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+
+def solve_sweep_shard(shard, solve_function, renew, run_seconds = None):
+    """This function solves every model run of a shard.
+
+    Missing values in the shard are passed on as None. Model runs which cannot be
+    solved or exceed the time limit keep NaN results with Converged set to 0.
+
+    Args:
+        shard (pd.DataFrame): The model run configurations of the shard.
+        solve_function (function): Maps a model run configuration to an EquilibriumResult.
+        renew (function): Called after every model run, returns False if the lease was lost.
+        run_seconds (float): The time limit of a model run, see limit_run_time.
+
+    Returns:
+        pd.DataFrame or None: The shard with the results appended as columns, None if
+            the lease was lost.
+
+    """
+    results = allocate_equilibrium_results(len(shard))
+
+    for i, run in enumerate(shard.to_dict(orient="records")):
+        configuration = {key: None if pd.isna(value) else value for key, value in run.items()}
+
+        try:
+            with limit_run_time(run_seconds):
+                results[i] = solve_function(configuration).to_array()
+        except (ValueError, ZeroDivisionError, TimeoutError):
+            results[i, EQUILIBRIUM_RESULT_COLUMNS.index("Converged")] = 0
+
+        if not renew():
+            return None
+
+    return pd.concat([shard, equilibrium_results_to_dataframe(results, index=shard.index)], axis=1)
+
+
+def run_sweep_worker(queue_directory, solve_function = calculate_equilibrium_result_power_utility, worker_id = None, lease_seconds = 600, poll_seconds = 5, run_seconds = 60, max_attempts = 3):
+    """This function runs a worker which solves shards until the queue is empty.
+
+    Model runs which cannot be solved or exceed the time limit get NaN results. While
+    shards claimed by other workers are outstanding, the worker keeps polling so it can
+    take over shards whose lease expires.
+
+    Args:
+        queue_directory (str or pathlib.Path): The shared queue directory.
+        solve_function (function): Maps a model run configuration to an EquilibriumResult.
+        worker_id (str): The id of the worker, defaults to "<host name>-<process id>".
+        lease_seconds (float): The duration of a lease, renewed after every model run.
+        poll_seconds (float): The time to wait while only claimed shards are left.
+        run_seconds (float): The time limit of a model run, should be well below
+            lease_seconds, None for no limit.
+        max_attempts (int): The number of expired leases after which a shard fails.
+
+    Returns:
+        int: The number of shards solved by this worker.
+
+    """
+    queue_directory = Path(queue_directory)
+
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}-{os.getpid()}".replace(LEASE_SEPARATOR, "-")
+
+    number_of_solved_shards = 0
+
+    while True:
+        reclaim_expired_leases(queue_directory, max_attempts)
+
+        claimed_path = claim_shard(queue_directory, worker_id, lease_seconds)
+
+        if claimed_path is None:
+            if not any((queue_directory / "claimed").glob("shard_*.csv")):
+                return number_of_solved_shards
+            time.sleep(poll_seconds)
+            continue
+
+        shard_name, _, _, _ = parse_claimed_path(claimed_path)
+        lease = {"path": claimed_path}
+
+        def renew(lease=lease):
+            lease["path"] = renew_lease(lease["path"], lease_seconds)
+            return lease["path"] is not None
+
+        output = solve_sweep_shard(pd.read_csv(claimed_path, index_col="Run"), solve_function, renew, run_seconds)
+
+        if output is None:
+            continue
+
+        write_file_atomically(output, queue_directory / "results" / f"{shard_name}.csv")
+        release_shard(lease["path"])
+
+        number_of_solved_shards += 1
+
+
+def merge_sweep_results(queue_directory):
+    """This function merges the result fragments of a finished sweep.
+
+    The result fragments have to match the shards in the manifest exactly, so a sweep
+    with missing or foreign fragments is refused instead of being merged silently.
+
+    Args:
+        queue_directory (str or pathlib.Path): The shared queue directory.
+
+    Returns:
+        pd.DataFrame: The grid with the results, in the order of the grid.
+
+    """
+    queue_directory = Path(queue_directory)
+
+    manifest_path = queue_directory / MANIFEST_NAME
+    if not manifest_path.exists():
+        info = f"The queue directory {queue_directory} has no manifest, it was not written by write_sweep_shards."
+        raise ValueError(info)
+
+    manifest = json.loads(manifest_path.read_text())
+
+    unfinished_shards = [*(queue_directory / "pending").glob("shard_*.csv"), *(queue_directory / "claimed").glob("shard_*.csv")]
+    if unfinished_shards:
+        info = f"The sweep is not finished, {len(unfinished_shards)} shards are pending or claimed."
+        raise ValueError(info)
+
+    fragment_paths = sorted((queue_directory / "results").glob("shard_*.csv"))
+    fragment_names = [path.stem for path in fragment_paths]
+
+    if len(fragment_paths) != manifest["number_of_shards"] or fragment_names != sorted(manifest["shards"]):
+        missing_shards = sorted(set(manifest["shards"]) - set(fragment_names))
+        foreign_shards = sorted(set(fragment_names) - set(manifest["shards"]))
+        info = f"The sweep has {len(fragment_paths)} result fragments for {manifest['number_of_shards']} shards, missing: {missing_shards}, not in the manifest: {foreign_shards}."
+        raise ValueError(info)
+
+    output = pd.concat([pd.read_csv(path, index_col="Run") for path in fragment_paths]).sort_index()
+
+    if len(output) != manifest["number_of_runs"]:
+        info = f"The sweep has {len(output)} results for {manifest['number_of_runs']} model runs."
+        raise ValueError(info)
+
+    return output
+
+
+def main(argv = None):
+    """Run a sweep worker or merge a sweep from the command line."""
+    parser = argparse.ArgumentParser(description="Work on a sweep in a shared queue directory.")
+    parser.add_argument("command", choices=["worker", "merge"])
+    parser.add_argument("queue_directory", type=Path)
+    parser.add_argument("--lease-seconds", type=float, default=600)
+    parser.add_argument("--run-seconds", type=float, default=60, help="The time limit of a model run.")
+    parser.add_argument("--max-attempts", type=int, default=3, help="The number of expired leases after which a shard fails.")
+    parser.add_argument("--output", type=Path, help="The csv file to write the merged results to.")
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "worker":
+        run_sweep_worker(arguments.queue_directory, lease_seconds=arguments.lease_seconds, run_seconds=arguments.run_seconds, max_attempts=arguments.max_attempts)
+    else:
+        merge_sweep_results(arguments.queue_directory).to_csv(arguments.output or arguments.queue_directory / "results.csv")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,44 @@
+import multiprocessing
+import time
+
 import numpy as np
+import pytest
+from sympy import symbols
+from theory_model_stock_gambling.calibration_functions import (
+    calibrate_preference_parameters,
+    calibrate_preference_parameters_in_parallel,
+    calibrate_preference_parameters_sequentially,
+    generate_equilibrium_moments_function,
+)
+from theory_model_stock_gambling.config import MODEL_RUN_CONFIGURATION
 from theory_model_stock_gambling.model_functions import (
+    EquilibriumResult,
+    allocate_equilibrium_results,
+    calculate_all_equilibria,
+    calculate_all_equilibria_solution_power_utility,
+    calculate_equilibrium_solution_log_utility,
+    calculate_equilibrium_result_power_utility,
     calculate_equilibrium_solution_power_utility,
+    calculate_equilibrium_solution_power_utility_distribution,
+    calculate_expected_utility_power,
+    calculate_expected_utility_power_distribution,
+    calculate_moments_of_distribution,
+    calculate_optimization_condition_power_utility_distribution,
+    calculate_variance_for_bernoulli_stock,
+    discretize_bernoulli_distribution,
+    discretize_lognormal_distribution,
+    discretize_mixture_distribution,
+    equilibrium_results_to_dataframe,
+    generate_numerical_system_and_jacobian,
+    sensitivity_analysis_variance_weight,
+)
+from theory_model_stock_gambling.sweep_functions import (
+    claim_shard,
+    generate_sweep_grid,
+    merge_sweep_results,
+    reclaim_expired_leases,
+    run_sweep_worker,
+    write_sweep_shards,
 )
 
 
@@ -41,3 +79,346 @@ def test_calculate_equilibrium_solution_power_utility_equal_input_equal_weights(
 
     assert np.isclose(actual_result["x_1"] == expected_weight_x_1)
     assert np.isclose(actual_result["x_2"] == expected_weight_x_2)
+
+
+def test_calculate_all_equilibria_solution_power_utility_finds_unique_stable_equilibrium():
+
+    equilibria = calculate_all_equilibria_solution_power_utility(
+    W_1 = 1, W_2 = 1,
+    prob_e_1_high = 0.5, return_e_1_high = 1.2, return_e_1_low = 0.8,
+    prob_e_2_high = 0.5, return_e_2_high = 1.2, return_e_2_low = 0.8,
+    prob_R_high = 0.1, return_R_high = 10, return_R_low = 0.8,
+    risk_aversion_1 = 2, risk_aversion_2 = 2,
+    number_of_starting_points = 32)
+
+    assert len(equilibria) == 1
+    assert np.isclose(equilibria[0]["x_1"], 0.5)
+    assert np.isclose(equilibria[0]["x_2"], 0.5)
+    assert equilibria[0].stable == 1
+    assert equilibria[0].residual < 1e-10
+
+
+def test_calculate_all_equilibria_finds_and_classifies_every_root():
+
+    x_1, x_2, p = symbols("x_1 x_2 p")
+
+    #The excess demand -(p - 1)(p - 2)(p - 3) falls at p = 1 and p = 3 and rises at p = 2
+    system_of_equations_to_solve = [0.5 - (p - 1) * (p - 2) * (p - 3) - x_1, 0.5 - x_2, x_1 + x_2 - 1]
+
+    residual_function, jacobian_function = generate_numerical_system_and_jacobian(system_of_equations_to_solve)
+
+    starting_points = np.column_stack([np.full(41, 0.5), np.full(41, 0.5), np.linspace(0, 4, 41)])
+
+    equilibria = calculate_all_equilibria(residual_function, jacobian_function, starting_points)
+
+    assert np.allclose([equilibrium.p for equilibrium in equilibria], [1, 2, 3])
+    assert [equilibrium.stable for equilibrium in equilibria] == [1, 0, 1]
+
+
+def test_calculate_all_equilibria_solution_power_utility_high_risk_aversion_has_no_spurious_equilibria():
+
+    equilibria = calculate_all_equilibria_solution_power_utility(1, 1, 0.5, 1.2, 0.8, 0.5, 1.2, 0.8, 0.01, 10, 0.6, 10, 10)
+
+    assert len(equilibria) == 1
+    assert np.isclose(equilibria[0]["x_1"], 0.5)
+
+
+def test_calculate_all_equilibria_solution_power_utility_finds_equilibrium_with_lottery_stock():
+
+    equilibria = calculate_all_equilibria_solution_power_utility(1, 1, 0.5, 1.2, 0.8, 0.5, 1.2, 0.8, 0.1, 100, 0.6, 0.5, 0.5)
+
+    assert len(equilibria) == 1
+    assert np.isclose(equilibria[0]["x_1"], 0.5)
+    assert np.isclose(equilibria[0]["p"], 2.237226025)
+
+
+def test_sensitivity_analysis_variance_weight_detecting_multiple_equilibria_completes_with_lottery_stock():
+
+    output = sensitivity_analysis_variance_weight(1, 1, 0.5, 1.2, 0.8, 0.5, 1.2, 0.8, 0.1, 100, 0.6, 0.5, 0.5, detect_multiple_equilibria = True)
+
+    assert (output["Number_Of_Equilibria"] == 1).all()
+    assert (output["Converged"] == 1).all()
+
+
+def test_calibrate_preference_parameters_recovers_true_parameters():
+
+    parameters_to_calibrate = ["Variance_Weight", "Risk_Aversion_Agent_1"]
+
+    calculate_equilibrium_moments = generate_equilibrium_moments_function(parameters_to_calibrate, MODEL_RUN_CONFIGURATION)
+
+    _, moments, _ = calculate_equilibrium_moments(np.array([0.005, 3.0]), (0.5, 0.5, 1))
+
+    result = calibrate_preference_parameters(
+    targets = {"p": moments[0], "x_2": moments[1]},
+    parameters_to_calibrate = parameters_to_calibrate,
+    initial_guess = {"Variance_Weight": 0.01, "Risk_Aversion_Agent_1": 2},
+    calculate_equilibrium_moments = calculate_equilibrium_moments)
+
+    assert result["Success"]
+    assert np.isclose(result["Variance_Weight"], 0.005)
+    assert np.isclose(result["Risk_Aversion_Agent_1"], 3.0)
+    assert np.isclose(result["Welfare_Gap"], moments[2])
+
+
+def test_calibrate_preference_parameters_recovers_skewness_weight_of_log_utility_model():
+
+    equilibrium = calculate_equilibrium_solution_log_utility(1, 1, 0.5, 1.2, 0.8, 0.5, 1.2, 0.8, 0.1, 10, 0.6, skewness_weight = 0.05)
+
+    result = calibrate_preference_parameters(targets = {"p": equilibrium.p}, parameters_to_calibrate = ["Skewness_Weight"], utility_function = "log")
+
+    assert result["Success"]
+    assert np.isclose(result["Skewness_Weight"], 0.05)
+    assert np.isclose(result["x_2"], equilibrium.x_2)
+
+
+def test_calibrate_preference_parameters_reports_failure_when_equilibrium_is_not_found():
+
+    def calculate_equilibrium_moments(parameter_values, starting_point):
+        raise ValueError("No equilibrium")
+
+    result = calibrate_preference_parameters(targets = {"p": 1.2}, parameters_to_calibrate = ["Risk_Aversion_Agent_1"], calculate_equilibrium_moments = calculate_equilibrium_moments)
+
+    assert not result["Success"]
+    assert np.isnan(result["p"])
+
+
+def test_calibrate_preference_parameters_to_welfare_gap_across_log_utility():
+
+    calculate_equilibrium_moments = generate_equilibrium_moments_function(["Risk_Aversion_Agent_1"], MODEL_RUN_CONFIGURATION)
+
+    _, moments, _ = calculate_equilibrium_moments(np.array([0.7]), (0.5, 0.5, 1))
+
+    result = calibrate_preference_parameters(
+    targets = {"Welfare_Gap": moments[2]},
+    parameters_to_calibrate = ["Risk_Aversion_Agent_1"],
+    initial_guess = {"Risk_Aversion_Agent_1": 2},
+    calculate_equilibrium_moments = calculate_equilibrium_moments)
+
+    assert result["Success"]
+    assert np.isclose(result["Risk_Aversion_Agent_1"], 0.7)
+
+
+def test_calibrate_preference_parameters_continues_after_failed_trial_point():
+
+    calculate_equilibrium_moments = generate_equilibrium_moments_function(["Risk_Aversion_Agent_1"], MODEL_RUN_CONFIGURATION)
+
+    _, moments, _ = calculate_equilibrium_moments(np.array([0.7]), (0.5, 0.5, 1))
+
+    evaluated_parameter_values = []
+
+    def calculate_equilibrium_moments_failing_once(parameter_values, starting_point):
+        evaluated_parameter_values.append(parameter_values[0])
+        if len(evaluated_parameter_values) == 2:
+            raise ValueError("No equilibrium")
+        return calculate_equilibrium_moments(parameter_values, starting_point)
+
+    result = calibrate_preference_parameters(
+    targets = {"p": moments[0]},
+    parameters_to_calibrate = ["Risk_Aversion_Agent_1"],
+    initial_guess = {"Risk_Aversion_Agent_1": 1.2},
+    calculate_equilibrium_moments = calculate_equilibrium_moments_failing_once)
+
+    assert len(evaluated_parameter_values) > 2
+    assert result["Success"]
+    assert np.isclose(result["Risk_Aversion_Agent_1"], 0.7)
+
+
+def test_calibrate_preference_parameters_sequentially_and_in_parallel_agree():
+
+    target_sets = [{"p": 1.2}, {"p": 1.25}, {"p": 1.3}]
+
+    sequential_results = calibrate_preference_parameters_sequentially(target_sets, ["Risk_Aversion_Agent_1"])
+    parallel_results = calibrate_preference_parameters_in_parallel(target_sets, ["Risk_Aversion_Agent_1"], n_workers = 2)
+
+    assert calibrate_preference_parameters_in_parallel([], ["Risk_Aversion_Agent_1"]) == []
+    assert all(result["Success"] for result in sequential_results)
+    assert np.allclose([result["p"] for result in sequential_results], [1.2, 1.25, 1.3])
+    assert np.allclose([result["Risk_Aversion_Agent_1"] for result in parallel_results], [result["Risk_Aversion_Agent_1"] for result in sequential_results], rtol = 1e-6)
+
+
+def test_calculate_equilibrium_solution_power_utility_distribution_matches_bernoulli_model():
+
+    endowment_distribution = discretize_bernoulli_distribution(0.5, 1.2, 0.8)
+    stock_distribution = discretize_bernoulli_distribution(0.1, 10, 0.6)
+
+    expected_result = calculate_equilibrium_solution_power_utility(
+    W_1 = 1, W_2 = 1,
+    prob_e_1_high = 0.5, return_e_1_high = 1.2, return_e_1_low = 0.8,
+    prob_e_2_high = 0.5, return_e_2_high = 1.2, return_e_2_low = 0.8,
+    prob_R_high = 0.1, return_R_high = 10, return_R_low = 0.6,
+    risk_aversion_1 = 2, risk_aversion_2 = 2,
+    variance_weight = 0.01)
+
+    actual_result = calculate_equilibrium_solution_power_utility_distribution(
+    W_1 = 1, W_2 = 1,
+    endowment_distribution_1 = endowment_distribution,
+    endowment_distribution_2 = endowment_distribution,
+    stock_distribution = stock_distribution,
+    risk_aversion_1 = 2, risk_aversion_2 = 2,
+    variance_weight = 0.01)
+
+    assert np.isclose(calculate_moments_of_distribution(stock_distribution)["variance"], calculate_variance_for_bernoulli_stock(0.1, 0.9, 10, 0.6))
+    for key in ["x_1", "x_2", "p"]:
+        assert np.isclose(actual_result[key], float(expected_result[key]))
+    assert np.isclose(actual_result.utility_agent_1, calculate_expected_utility_power(1, actual_result.x_1, 0.5, 1.2, 0.8, 0.1, 10, 0.6, actual_result.p, 2))
+
+
+def test_calculate_equilibrium_solution_power_utility_distribution_solves_lottery_stock():
+
+    endowment_distribution = discretize_bernoulli_distribution(0.5, 1.2, 0.8)
+    stock_distribution = discretize_mixture_distribution([discretize_lognormal_distribution(-0.1, 0.2), discretize_bernoulli_distribution(1, 100, 100)], [0.99, 0.01])
+
+    result = calculate_equilibrium_solution_power_utility_distribution(
+    W_1 = 1, W_2 = 1,
+    endowment_distribution_1 = endowment_distribution,
+    endowment_distribution_2 = endowment_distribution,
+    stock_distribution = stock_distribution,
+    risk_aversion_1 = 2, risk_aversion_2 = 0.5)
+
+    condition_1, _, _ = calculate_optimization_condition_power_utility_distribution(1, np.array([result.x_1]), np.array([result.p]), 2, endowment_distribution, stock_distribution)
+    condition_2, _, _ = calculate_optimization_condition_power_utility_distribution(1, np.array([result.x_2]), np.array([result.p]), 0.5, endowment_distribution, stock_distribution)
+
+    assert np.allclose([condition_1[0], condition_2[0], result.x_1 + result.x_2 - 1], 0, atol = 1e-10)
+    assert result.p < calculate_moments_of_distribution(stock_distribution)["mean"]
+    assert np.isfinite(result.utility_agent_1) and np.isfinite(result.utility_agent_2)
+
+
+def test_calculate_expected_utility_power_distribution_matches_bernoulli_model():
+
+    endowment_distribution = discretize_bernoulli_distribution(0.5, 1.2, 0.8)
+    stock_distribution = discretize_bernoulli_distribution(0.1, 10, 0.6)
+
+    for gamma in [0.5, 2, 5]:
+        expected_utility = calculate_expected_utility_power(1, 0.3, 0.5, 1.2, 0.8, 0.1, 10, 0.6, 1.1, gamma)
+        assert np.isclose(calculate_expected_utility_power_distribution(1, 0.3, 1.1, gamma, endowment_distribution, stock_distribution), expected_utility)
+
+    wealth = 1 + np.array([1.2, 0.8])[:, np.newaxis] + 0.3 * (np.array([10, 0.6]) - 1.1)
+    expected_log_utility = np.outer([0.5, 0.5], [0.1, 0.9]).ravel() @ np.log(wealth).ravel()
+    assert np.isclose(calculate_expected_utility_power_distribution(1, 0.3, 1.1, 1, endowment_distribution, stock_distribution), expected_log_utility)
+
+
+def test_discretize_lognormal_distribution_matches_closed_form_moments():
+
+    mean_log, std_log = 0.1, 0.3
+
+    moments = calculate_moments_of_distribution(discretize_lognormal_distribution(mean_log, std_log, number_of_nodes = 32, shift = -0.5))
+
+    assert np.isclose(moments["mean"], np.exp(mean_log + std_log ** 2 / 2) - 0.5)
+    assert np.isclose(moments["variance"], (np.exp(std_log ** 2) - 1) * np.exp(2 * mean_log + std_log ** 2))
+    assert np.isclose(moments["skewness"], (np.exp(std_log ** 2) + 2) * np.sqrt(np.exp(std_log ** 2) - 1))
+
+
+def test_discretize_mixture_distribution_matches_closed_form_moments():
+
+    body = discretize_lognormal_distribution(0, 0.2, number_of_nodes = 32)
+    jackpot = discretize_bernoulli_distribution(1, 50, 0)
+
+    moments = calculate_moments_of_distribution(discretize_mixture_distribution([body, jackpot], [0.99, 0.01]))
+
+    mean_body, second_moment_body = np.exp(0.02), np.exp(0.08)
+    mean = 0.99 * mean_body + 0.01 * 50
+
+    assert np.isclose(moments["mean"], mean)
+    assert np.isclose(moments["variance"], 0.99 * second_moment_body + 0.01 * 50 ** 2 - mean ** 2)
+
+
+def test_run_sweep_worker_with_several_local_workers_solves_every_shard(tmp_path):
+
+    grid = generate_sweep_grid({"Variance_Weight": [0, 0.005], "Risk_Aversion_Agent_2": [2, 3, 4]})
+
+    write_sweep_shards(grid, tmp_path, shard_size = 2)
+
+    workers = [multiprocessing.Process(target=run_sweep_worker, args=(tmp_path,), kwargs={"poll_seconds": 0.1}) for _ in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    result = merge_sweep_results(tmp_path)
+
+    assert list(result.index) == list(range(len(grid)))
+    assert np.allclose(result["Risk_Aversion_Agent_2"], grid["Risk_Aversion_Agent_2"])
+    assert np.allclose(result["x_1"] + result["x_2"], 1)
+
+
+def test_reclaim_expired_leases_returns_shard_to_pending(tmp_path):
+
+    write_sweep_shards(generate_sweep_grid({"Variance_Weight": [0, 0.005]}), tmp_path, shard_size = 1)
+
+    claim_shard(tmp_path, "worker", lease_seconds = 600)
+    claim_shard(tmp_path, "worker", lease_seconds = -1)
+
+    assert reclaim_expired_leases(tmp_path) == 1
+    assert [path.name for path in (tmp_path / "pending").iterdir()] == ["shard_00001__1.csv"]
+
+
+def test_reclaim_expired_leases_fails_shard_after_max_attempts(tmp_path):
+
+    write_sweep_shards(generate_sweep_grid({"Variance_Weight": [0, 0.005]}), tmp_path, shard_size = 2)
+
+    for _ in range(2):
+        claim_shard(tmp_path, "worker", lease_seconds = -1)
+        assert reclaim_expired_leases(tmp_path, max_attempts = 2) == 1
+
+    assert not any((tmp_path / "pending").iterdir())
+    assert [path.name for path in (tmp_path / "failed").iterdir()] == ["shard_00000.csv"]
+    assert (merge_sweep_results(tmp_path)["Converged"] == 0).all()
+
+
+def solve_or_hang(configuration):
+    if configuration["Variance_Weight"] > 0:
+        time.sleep(60)
+    return calculate_equilibrium_result_power_utility(configuration)
+
+
+def test_run_sweep_worker_stops_model_runs_at_time_limit(tmp_path):
+
+    write_sweep_shards(generate_sweep_grid({"Variance_Weight": [0, 0.005]}), tmp_path)
+
+    start = time.time()
+    run_sweep_worker(tmp_path, solve_function = solve_or_hang, run_seconds = 0.5)
+
+    result = merge_sweep_results(tmp_path)
+
+    assert time.time() - start < 30
+    assert result["Converged"].tolist() == [1, 0]
+
+
+def test_sweep_refuses_reused_queue_and_incomplete_results(tmp_path):
+
+    write_sweep_shards(generate_sweep_grid({"Variance_Weight": [0, 0.005]}), tmp_path, shard_size = 1)
+    run_sweep_worker(tmp_path, poll_seconds = 0.1)
+
+    with pytest.raises(ValueError):
+        write_sweep_shards(generate_sweep_grid({"Variance_Weight": [0.01]}), tmp_path)
+
+    (tmp_path / "results" / "shard_00001.csv").unlink()
+
+    with pytest.raises(ValueError, match="missing"):
+        merge_sweep_results(tmp_path)
+
+
+def test_equilibrium_results_to_dataframe_does_not_copy_results():
+
+    results = allocate_equilibrium_results(3)
+    results[1] = EquilibriumResult(x_1 = 0.25, x_2 = 0.75, p = 1.1, residual = 0).to_array()
+
+    data = equilibrium_results_to_dataframe(results)
+
+    assert np.shares_memory(data["p"].to_numpy(), results)
+    assert (data.dtypes == np.float64).all()
+    assert data.loc[1, "x_2"] == 0.75
+    assert data.loc[1, "Converged"] == 1
+    assert np.isnan(data.loc[0, "p"])
+
+
+def test_equilibrium_result_reports_iterations_and_reads_column_names():
+
+    result = calculate_equilibrium_result_power_utility(MODEL_RUN_CONFIGURATION)
+
+    assert result.iterations >= 1
+    assert result.residual < 1e-12
+    assert result["Utility_Agent_1"] == result.utility_agent_1
+    assert result["Iterations"] == result["iterations"]
+    with pytest.raises(KeyError):
+        result["Welfare"]